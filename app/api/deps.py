@@ -1,8 +1,10 @@
 # app/api/deps.py
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
+from types import SimpleNamespace
 from typing import Optional
+from cachetools import TTLCache
 
 from app.core.database import get_db
 from app.core.security import decode_token
@@ -10,6 +12,42 @@ from app.models.user import User, UserRole
 
 security = HTTPBearer()
 
+# Una excepción nueva por request: una instancia compartida acumula traceback/contexto
+# y sus headers mutables quedan expuestos a todos los requests
+def _invalid_token_exc() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Token inválido",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def _user_not_found_exc() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Usuario no encontrado"
+    )
+
+# Proyección ligera del usuario autenticado, indexada por user_id
+_user_cache = TTLCache(maxsize=5000, ttl=60)
+
+def _snapshot_user(user: User) -> SimpleNamespace:
+    """Copia desacoplada de la sesión con los atributos que leen las rutas"""
+    location = SimpleNamespace(id=user.location.id, name=user.location.name) if user.location else None
+    return SimpleNamespace(
+        id=user.id,
+        email=user.email,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        role=user.role,
+        location_id=user.location_id,
+        location=location,
+        is_active=user.is_active
+    )
+
+def invalidate_user(user_id: int):
+    """Eliminar usuario del cache (logout, cambio de rol, desactivación)"""
+    _user_cache.pop(user_id, None)
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
@@ -20,27 +58,26 @@ async def get_current_user(
     payload = decode_token(token)
     
     if payload is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token inválido",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        raise _invalid_token_exc()
     
     user_id = payload.get("user_id")
     if user_id is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token inválido"
-        )
+        raise _invalid_token_exc()
+    
+    cached_user = _user_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
     
-    user = db.query(User).filter(User.id == user_id, User.is_active == True).first()
+    user = db.query(User).options(joinedload(User.location)).filter(
+        User.id == user_id,
+        User.is_active == True
+    ).first()
     if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Usuario no encontrado"
-        )
+        raise _user_not_found_exc()
     
-    return user
+    cached_user = _snapshot_user(user)
+    _user_cache[user_id] = cached_user
+    return cached_user
 
 def require_role(allowed_roles: list[UserRole]):
     """Decorator para requerir roles específicos"""
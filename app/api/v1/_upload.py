@@ -0,0 +1,63 @@
+# app/api/v1/_upload.py
+import os
+from contextlib import asynccontextmanager
+import aiofiles
+from fastapi import UploadFile, HTTPException, status
+
+from app.core.config import settings
+
+# Tamaño de bloque al volcar uploads a disco
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Una excepción nueva por request: una instancia compartida acumula traceback/contexto entre requests
+def _not_an_image_exc() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="El archivo debe ser una imagen (JPG, PNG, WEBP)"
+    )
+
+def _extension_not_allowed_exc() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Extensión no permitida. Usar: {', '.join(sorted(settings.ALLOWED_EXTENSIONS))}"
+    )
+
+def _file_too_large_exc() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Archivo muy grande. Máximo {settings.MAX_FILE_SIZE_MB}MB"
+    )
+
+def validate_image_upload(image: UploadFile, check_extension: bool = True) -> str:
+    """Validar tipo (y opcionalmente extensión) del upload; devuelve la extensión"""
+    if not image.content_type or not image.content_type.startswith('image/'):
+        raise _not_an_image_exc()
+
+    file_extension = os.path.splitext(image.filename or "image.jpg")[1].lower()
+    if check_extension and file_extension not in settings.ALLOWED_EXTENSIONS:
+        raise _extension_not_allowed_exc()
+
+    return file_extension
+
+@asynccontextmanager
+async def temporary_upload(image: UploadFile, suffix: str = ".jpg"):
+    """Volcar el upload por bloques a un archivo temporal, que se borra al salir"""
+    temp_path = None
+    try:
+        total_size = 0
+        async with aiofiles.tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+            temp_path = tmp_file.name
+            while chunk := await image.read(UPLOAD_CHUNK_SIZE):
+                total_size += len(chunk)
+                if total_size > settings.MAX_FILE_SIZE:
+                    raise _file_too_large_exc()
+                await tmp_file.write(chunk)
+
+        yield temp_path
+
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
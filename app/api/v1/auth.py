@@ -1,16 +1,18 @@
 # app/api/v1/auth.py
+import asyncio
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.orm import Session, joinedload
 
 from app.core.database import get_db
 from app.core.security import verify_password, create_access_token
 from app.core.config import settings
 from app.models.user import User
 from app.schemas.user import UserLogin, UserResponse, Token
-from app.api.deps import get_current_user
+from app.api.deps import get_current_user, invalidate_user
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
 
 @router.post("/login", response_model=Token)
 async def login(
@@ -20,12 +22,13 @@ async def login(
     """Login con email y password"""
     
     # Buscar usuario por email
-    user = db.query(User).filter(
+    user = db.query(User).options(joinedload(User.location)).filter(
         User.email == credentials.email,
         User.is_active == True
     ).first()
     
-    if not user or not verify_password(credentials.password, user.password_hash):
+    # bcrypt es costoso: verificar fuera del event loop
+    if not user or not await asyncio.to_thread(verify_password, credentials.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email o contraseña incorrectos",
@@ -75,4 +78,5 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 @router.post("/logout")
 async def logout(current_user: User = Depends(get_current_user)):
     """Logout"""
+    invalidate_user(current_user.id)
     return {"message": "Logout exitoso", "user": current_user.email}
\ No newline at end of file
@@ -1,34 +1,40 @@
 # app/api/v1/classification.py
-import os
 import time
-import tempfile
-import aiofiles
+import bisect
+import asyncio
 from datetime import datetime
 from fastapi import APIRouter, File, UploadFile, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
-from app.core.config import settings
+from app.core.logging import get_logger
 from app.models.user import User
-from app.schemas.classification import ScanResponse, ClassificationResult
+from app.models.sneaker import SneakerReference
+from app.schemas.classification import ScanResponse, ClassificationResult, AddSneakerForm
 from app.services.classification.clip_service import clip_service
 from app.services.inventory.inventory_service import InventoryService
-from app.api.deps import get_current_user, get_vendedor
+from app.api.deps import get_current_user, get_vendedor, get_admin
+from app.api.v1._upload import validate_image_upload, temporary_upload
 
 router = APIRouter()
+logger = get_logger(__name__)
+inventory_service = InventoryService()
+
+# Umbrales de confianza (ordenados) y etiqueta de cada tramo
+_CONFIDENCE_THRESHOLDS = (0.65, 0.80, 0.90)
+_CONFIDENCE_LABELS = ("baja", "media", "alta", "muy_alta")
 
 def _get_confidence_level(similarity_score: float) -> str:
     """Determinar nivel de confianza"""
-    if similarity_score >= 0.90:
-        return "muy_alta"
-    elif similarity_score >= 0.80:
-        return "alta"
-    elif similarity_score >= 0.65:
-        return "media"
-    else:
-        return "baja"
+    return _CONFIDENCE_LABELS[bisect.bisect_right(_CONFIDENCE_THRESHOLDS, similarity_score)]
 
-@router.post("/scan", response_model=ScanResponse)
+@router.post(
+    "/scan",
+    response_model=ScanResponse,
+    response_model_exclude_none=True,
+    response_class=ORJSONResponse
+)
 async def scan_sneaker(
     image: UploadFile = File(...),
     current_user: User = Depends(get_vendedor),
@@ -39,44 +45,18 @@ async def scan_sneaker(
     """
     start_time = time.time()
     
-    # Validaciones
-    if not image.content_type or not image.content_type.startswith('image/'):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="El archivo debe ser una imagen (JPG, PNG, WEBP)"
-        )
-    
-    # Validar tamaño
-    content = await image.read()
-    if len(content) > settings.MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"Archivo muy grande. Máximo {settings.MAX_FILE_SIZE // 1024 // 1024}MB"
-        )
-    
-    # Validar extensión
-    file_extension = os.path.splitext(image.filename or "image.jpg")[1].lower()
-    if file_extension not in settings.ALLOWED_EXTENSIONS:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Extensión no permitida. Usar: {', '.join(settings.ALLOWED_EXTENSIONS)}"
-        )
-    
-    temp_image_path = None
+    # Validaciones (tipo y extensión)
+    file_extension = validate_image_upload(image)
     
     try:
-        # Guardar temporalmente
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as tmp_file:
-            tmp_file.write(content)
-            temp_image_path = tmp_file.name
-        
-        print(f"🔍 Procesando imagen para: {current_user.email}")
-        
-        # Clasificar con CLIP + Pinecone
-        classification_results = await clip_service.classify_sneaker(
-            temp_image_path, 
-            top_k=5
-        )
+        async with temporary_upload(image, suffix=file_extension) as temp_image_path:
+            logger.info("🔍 Procesando imagen para: %s", current_user.email)
+            
+            # Clasificar con CLIP + Pinecone
+            classification_results = await clip_service.classify_sneaker(
+                temp_image_path, 
+                top_k=5
+            )
         
         if not classification_results:
             processing_time = (time.time() - start_time) * 1000
@@ -97,17 +77,24 @@ async def scan_sneaker(
                 ]
             )
         
-        # Enriquecer con inventario
-        inventory_service = InventoryService()
-        enriched_results = []
-        
-        for result in classification_results:
-            try:
-                inventory_data = await inventory_service.get_inventory_by_reference(
+        # Enriquecer con inventario (consultas independientes en paralelo)
+        inventory_results = await asyncio.gather(
+            *[
+                inventory_service.get_inventory_by_reference(
                     reference_code=result['model_name'],
                     user_location_id=current_user.location_id or 1,
                     db=db
                 )
+                for result in classification_results
+            ],
+            return_exceptions=True
+        )
+        enriched_results = []
+        
+        for result, inventory_data in zip(classification_results, inventory_results):
+            try:
+                if isinstance(inventory_data, Exception):
+                    raise inventory_data
                 
                 confidence_level = _get_confidence_level(result['similarity_score'])
                 
@@ -134,7 +121,7 @@ async def scan_sneaker(
                 enriched_results.append(enriched_result)
                 
             except Exception as e:
-                print(f"⚠️ Error enriqueciendo {result['model_name']}: {e}")
+                logger.warning("⚠️ Error enriqueciendo %s: %s", result['model_name'], e)
                 continue
         
         # Respuesta final
@@ -150,23 +137,17 @@ async def scan_sneaker(
             processing_time_ms=processing_time
         )
         
-        print(f"✅ Clasificación completada en {processing_time:.0f}ms")
+        logger.info("✅ Clasificación completada en %.0fms", processing_time)
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ Error en clasificación: {str(e)}")
+        logger.error("❌ Error en clasificación: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error procesando imagen: {str(e)}"
         )
-    
-    finally:
-        # Limpiar archivo temporal
-        if temp_image_path and os.path.exists(temp_image_path):
-            try:
-                os.unlink(temp_image_path)
-            except:
-                pass
 
 @router.get("/health")
 async def classification_health():
@@ -182,71 +163,55 @@ async def classification_health():
 @router.post("/add-sneaker")
 async def add_sneaker_to_database(
     image: UploadFile = File(...),
-    reference_code: str,
-    brand: str,
-    model: str,
-    color: str = "",
-    description: str = "",
+    form: AddSneakerForm = Depends(AddSneakerForm.as_form),
     current_user: User = Depends(get_admin),  # Solo admins pueden agregar
     db: Session = Depends(get_db)
 ):
     """Agregar nuevo tenis a la BD vectorial (Para admins)"""
     
-    if not image.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="Debe ser una imagen")
+    validate_image_upload(image, check_extension=False)
     
     # Verificar que no exista la referencia
     existing = db.query(SneakerReference).filter(
-        SneakerReference.reference_code == reference_code
+        SneakerReference.reference_code == form.reference_code
     ).first()
     
     if existing:
         raise HTTPException(status_code=400, detail="Referencia ya existe")
     
-    temp_path = None
-    try:
-        # Guardar imagen temporalmente
-        content = await image.read()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-            tmp.write(content)
-            temp_path = tmp.name
-        
-        # Preparar metadata
-        metadata = {
-            "brand": brand,
-            "model": model,
-            "color": color,
-            "description": description
-        }
-        
-        # Agregar a Pinecone
+    # Preparar metadata
+    metadata = {
+        "brand": form.brand,
+        "model": form.model,
+        "color": form.color,
+        "description": form.description
+    }
+    
+    # Agregar a Pinecone (la imagen solo se necesita en disco durante esta llamada)
+    async with temporary_upload(image) as temp_path:
         success = await clip_service.add_sneaker_to_database(
             image_path=temp_path,
-            reference_code=reference_code,
+            reference_code=form.reference_code,
             metadata=metadata
         )
-        
-        if not success:
-            raise HTTPException(status_code=500, detail="Error agregando a Pinecone")
-        
-        # Agregar a BD relacional
-        sneaker_ref = SneakerReference(
-            reference_code=reference_code,
-            brand=brand,
-            model=model,
-            color=color,
-            description=description
-        )
-        
-        db.add(sneaker_ref)
-        db.commit()
-        
-        return {
-            "message": "Tenis agregado exitosamente",
-            "reference_code": reference_code,
-            "added_by": current_user.email
-        }
-        
-    finally:
-        if temp_path and os.path.exists(temp_path):
-            os.unlink(temp_path)
\ No newline at end of file
+    
+    if not success:
+        raise HTTPException(status_code=500, detail="Error agregando a Pinecone")
+    
+    # Agregar a BD relacional
+    sneaker_ref = SneakerReference(
+        reference_code=form.reference_code,
+        brand=form.brand,
+        model=form.model,
+        color=form.color,
+        description=form.description
+    )
+    
+    db.add(sneaker_ref)
+    db.commit()
+    
+    return {
+        "message": "Tenis agregado exitosamente",
+        "reference_code": form.reference_code,
+        "added_by": current_user.email
+    }
@@ -1,7 +1,11 @@
 # app/core/config.py
-import os
+from functools import cached_property, lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
-class Settings:
+class Settings(BaseSettings):
+    """Configuración leída una sola vez desde variables de entorno"""
+    model_config = SettingsConfigDict(frozen=True)
+    
     API_V1_STR: str = "/api/v1"
     PROJECT_NAME: str = "TuStockYa Backend"
     VERSION: str = "1.0.0"
@@ -10,13 +14,23 @@ class Settings:
     SECRET_KEY: str = "super-secret-key-cambia-en-produccion"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 10080
+    BCRYPT_ROUNDS: int = 12
     
     # Files
     UPLOAD_DIR: str = "data/uploads"
     MAX_FILE_SIZE: int = 10485760
+    ALLOWED_EXTENSIONS: frozenset[str] = frozenset({".jpg", ".jpeg", ".png", ".webp"})
     
     # Environment
     DEBUG: bool = True
     ENVIRONMENT: str = "development"
+    
+    @cached_property
+    def MAX_FILE_SIZE_MB(self) -> int:
+        return self.MAX_FILE_SIZE // 1024 // 1024
+
+@lru_cache
+def get_settings() -> Settings:
+    return Settings()
 
-settings = Settings()
\ No newline at end of file
+settings = get_settings()
@@ -1,108 +1,193 @@
 # app/core/database_sqlite.py
 import sqlite3
 import os
+import queue
+import threading
 from contextlib import contextmanager
-from typing import Generator
+from typing import Generator, Optional
+
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
 
 # Crear directorio para SQLite
 os.makedirs("data", exist_ok=True)
 SQLITE_DB_PATH = "data/tustockya.db"
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "8"))
+
+# Configuración aplicada una sola vez por conexión
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Tablas STRICT (SQLite 3.37+): los tipos se validan al insertar
+TABLE_OPTIONS = " STRICT" if sqlite3.sqlite_version_info >= (3, 37, 0) else ""
 
-def get_db_connection():
-    """Obtener conexión SQLite"""
-    conn = sqlite3.connect(SQLITE_DB_PATH)
+def get_db_connection(readonly: bool = False, isolation_level: str = ""):
+    """Obtener conexión SQLite configurada"""
+    # cached_statements: las consultas frecuentes se preparan una vez por conexión
+    conn = sqlite3.connect(
+        SQLITE_DB_PATH,
+        check_same_thread=False,
+        isolation_level=isolation_level,
+        cached_statements=256
+    )
     conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    if readonly:
+        conn.execute("PRAGMA query_only=ON")
     return conn
 
+# Con WAL los lectores no se bloquean entre sí: N conexiones de solo lectura
+# y una única conexión de escritura (SQLite serializa las escrituras igualmente).
+# Los pools se abren en el primer uso, no al importar el módulo
+_read_pool: Optional[queue.Queue] = None
+_write_pool: Optional[queue.Queue] = None
+_pools_lock = threading.Lock()
+
+def _get_read_pool() -> queue.Queue:
+    global _read_pool
+    if _read_pool is None:
+        with _pools_lock:
+            if _read_pool is None:
+                pool = queue.Queue(maxsize=SQLITE_READ_POOL_SIZE)
+                for _ in range(SQLITE_READ_POOL_SIZE):
+                    pool.put(get_db_connection(readonly=True))
+                _read_pool = pool
+    return _read_pool
+
+def _get_write_pool() -> queue.Queue:
+    global _write_pool
+    if _write_pool is None:
+        with _pools_lock:
+            if _write_pool is None:
+                pool = queue.Queue(maxsize=1)
+                pool.put(get_db_connection(isolation_level=None))
+                _write_pool = pool
+    return _write_pool
+
 @contextmanager
-def get_db() -> Generator[sqlite3.Connection, None, None]:
-    """Context manager para BD"""
-    conn = get_db_connection()
+def get_read_db() -> Generator[sqlite3.Connection, None, None]:
+    """Conexión de solo lectura tomada del pool"""
+    pool = _get_read_pool()
+    conn = pool.get()
     try:
         yield conn
     finally:
-        conn.close()
+        pool.put(conn)
+
+@contextmanager
+def get_write_db() -> Generator[sqlite3.Connection, None, None]:
+    """Conexión de escritura; todo el bloque corre en una transacción BEGIN IMMEDIATE"""
+    pool = _get_write_pool()
+    conn = pool.get()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        pool.put(conn)
+
+def create_tables(conn: sqlite3.Connection):
+    """Crear tablas SQLite (sin commit: el llamador controla la transacción)"""
+    # Tabla ubicaciones (primero porque es referenciada)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS locations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            address TEXT,
+            phone TEXT,
+            is_active INTEGER DEFAULT 1,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        ){TABLE_OPTIONS}
+    ''')
+    
+    # Tabla usuarios
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT 'vendedor',
+            location_id INTEGER,
+            is_active INTEGER DEFAULT 1,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (location_id) REFERENCES locations (id)
+        ){TABLE_OPTIONS}
+    ''')
+    
+    # Índices para login (cubre la consulta completa) y búsqueda por id
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_email_active
+        ON users (email, is_active, location_id, password_hash, first_name, last_name, role)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_active_id ON users (is_active, id)')
+    
+    # Tabla referencias de tenis
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS sneaker_references (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reference_code TEXT UNIQUE NOT NULL,
+            brand TEXT NOT NULL,
+            model TEXT NOT NULL,
+            color TEXT,
+            gender TEXT DEFAULT 'unisex',
+            image_url TEXT,
+            description TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        ){TABLE_OPTIONS}
+    ''')
+    
+    # Tabla inventario
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS inventory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sneaker_reference_id INTEGER NOT NULL,
+            location_id INTEGER NOT NULL,
+            size TEXT NOT NULL,
+            quantity_stock INTEGER DEFAULT 0,
+            quantity_exhibition INTEGER DEFAULT 0,
+            unit_price REAL,
+            box_price REAL,
+            minimum_stock INTEGER DEFAULT 5,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (sneaker_reference_id) REFERENCES sneaker_references (id),
+            FOREIGN KEY (location_id) REFERENCES locations (id),
+            UNIQUE(sneaker_reference_id, location_id, size)
+        ){TABLE_OPTIONS}
+    ''')
 
 def init_database():
-    """Crear tablas SQLite"""
-    print("🔧 Inicializando base de datos SQLite...")
+    """Crear tablas SQLite en una sola transacción"""
+    logger.info("🔧 Inicializando base de datos SQLite...")
     
-    with get_db() as conn:
-        # Tabla ubicaciones (primero porque es referenciada)
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS locations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                type TEXT NOT NULL,
-                address TEXT,
-                phone TEXT,
-                is_active BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabla usuarios
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                first_name TEXT NOT NULL,
-                last_name TEXT NOT NULL,
-                role TEXT NOT NULL DEFAULT 'vendedor',
-                location_id INTEGER,
-                is_active BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (location_id) REFERENCES locations (id)
-            )
-        ''')
-        
-        # Tabla referencias de tenis
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS sneaker_references (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                reference_code TEXT UNIQUE NOT NULL,
-                brand TEXT NOT NULL,
-                model TEXT NOT NULL,
-                color TEXT,
-                gender TEXT DEFAULT 'unisex',
-                image_url TEXT,
-                description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabla inventario
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS inventory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sneaker_reference_id INTEGER NOT NULL,
-                location_id INTEGER NOT NULL,
-                size TEXT NOT NULL,
-                quantity_stock INTEGER DEFAULT 0,
-                quantity_exhibition INTEGER DEFAULT 0,
-                unit_price REAL,
-                box_price REAL,
-                minimum_stock INTEGER DEFAULT 5,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (sneaker_reference_id) REFERENCES sneaker_references (id),
-                FOREIGN KEY (location_id) REFERENCES locations (id),
-                UNIQUE(sneaker_reference_id, location_id, size)
-            )
-        ''')
-        
-        conn.commit()
-        print("✅ Tablas SQLite creadas correctamente")
+    with get_write_db() as conn:
+        create_tables(conn)
+    logger.info("✅ Tablas SQLite creadas correctamente")
 
 # Redis (opcional)
 try:
     import redis
     redis_client = redis.from_url("redis://localhost:6379/0", decode_responses=True)
     redis_client.ping()  # Test conexión
-    print("✅ Redis conectado")
+    logger.info("✅ Redis conectado")
 except Exception as e:
     redis_client = None
-    print(f"⚠️ Redis no disponible: {e}")
+    logger.warning("⚠️ Redis no disponible: %s", e)
 
 def get_redis():
     return redis_client
\ No newline at end of file
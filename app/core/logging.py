@@ -0,0 +1,35 @@
+# app/core/logging.py
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+_listener = None
+
+def setup_logging():
+    """Configurar logging no bloqueante: los handlers escriben en un hilo aparte"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.Queue(-1)
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(LOG_LEVEL)
+    app_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    app_logger.propagate = False
+
+def get_logger(name: str) -> logging.Logger:
+    """Obtener logger de un módulo de la app"""
+    setup_logging()
+    return logging.getLogger(name)
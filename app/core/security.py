@@ -1,32 +1,60 @@
 # app/core/security.py
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import Optional
-from passlib.context import CryptContext
+import hashlib
+import threading
+import time
+from cachetools import TTLCache
+import bcrypt
 import jwt
 
-SECRET_KEY = "super-secret-key-cambia-en-produccion"
-ALGORITHM = "HS256"
+from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Cache de tokens ya verificados, indexado por SHA-256 del token
+_token_cache = TTLCache(maxsize=10000, ttl=30)
+# Cache negativo (más corto) para no re-verificar tokens inválidos en ráfaga
+_invalid_token_cache = TTLCache(maxsize=10000, ttl=5)
+_token_cache_lock = threading.Lock()
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expires_seconds = int(expires_delta.total_seconds())
     else:
-        expire = datetime.utcnow() + timedelta(minutes=10080)
+        expires_seconds = settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
     
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # exp como entero epoch: evita construir y serializar datetimes
+    to_encode["exp"] = int(time.time()) + expires_seconds
+    return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)).decode()
 
 def decode_token(token: str) -> Optional[dict]:
+    key = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+
+    with _token_cache_lock:
+        if key in _invalid_token_cache:
+            return None
+        payload = _token_cache.get(key)
+
+    # El TTL del cache no debe extender la vida de un token ya expirado
+    if payload is not None and payload["exp"] > now:
+        return payload
+
     try:
-        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
     except:
-        return None
\ No newline at end of file
+        payload = None
+
+    with _token_cache_lock:
+        if payload is None:
+            _invalid_token_cache[key] = True
+        elif payload.get("exp", 0) > now:
+            _token_cache[key] = payload
+
+    return payload
\ No newline at end of file
@@ -6,12 +6,13 @@ import tempfile
 import random
 import asyncio
 from datetime import datetime, timedelta
+from functools import lru_cache
 
 from fastapi import FastAPI, HTTPException, status, File, UploadFile, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-from passlib.context import CryptContext
 import jwt
 
 # ==================== CONFIGURACIÓN PARA RAILWAY ====================
@@ -38,7 +39,12 @@ os.makedirs(upload_dir, exist_ok=True)
 
 ALGORITHM = "HS256"
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@lru_cache(maxsize=1)
+def _pwd_context():
+    """CryptContext perezoso: passlib tarda en cargar backends y solo se usa en login"""
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
 security = HTTPBearer()
 # ==================== SCHEMAS ====================
 
@@ -101,7 +107,7 @@ class ReturnNotification(BaseModel):
 # ==================== FUNCIONES DE SEGURIDAD ====================
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return _pwd_context().verify(plain_password, hashed_password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -148,7 +154,8 @@ app = FastAPI(
     title="TuStockYa Backend - Railway Ready",
     version="1.0.0",
     docs_url="/docs",
-    description="Sistema completo para gestión de inventario de tenis con módulo seller completo - Railway Compatible"
+    description="Sistema completo para gestión de inventario de tenis con módulo seller completo - Railway Compatible",
+    default_response_class=ORJSONResponse
 )
 
 # CORS mejorado para Railway
@@ -1,4 +1,5 @@
 # app/schemas/classification.py
+from fastapi import Form
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from datetime import datetime
@@ -29,4 +30,29 @@ class ScanResponse(BaseModel):
     total_matches_found: int
     processing_time_ms: float
     error: Optional[str] = None
-    suggestions: Optional[List[str]] = None
\ No newline at end of file
+    suggestions: Optional[List[str]] = None
+
+class AddSneakerForm(BaseModel):
+    reference_code: str
+    brand: str
+    model: str
+    color: str = ""
+    description: str = ""
+    
+    @classmethod
+    def as_form(
+        cls,
+        reference_code: str = Form(...),
+        brand: str = Form(...),
+        model: str = Form(...),
+        color: str = Form(""),
+        description: str = Form("")
+    ) -> "AddSneakerForm":
+        """Construir desde campos multipart (se usa con Depends)"""
+        return cls(
+            reference_code=reference_code,
+            brand=brand,
+            model=model,
+            color=color,
+            description=description
+        )
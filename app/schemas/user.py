@@ -1,12 +1,16 @@
 # app/schemas/user.py
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, EmailStr, StringConstraints
+from typing import Annotated, Optional
 
 class UserLogin(BaseModel):
-    email: str  # Cambiar de EmailStr a str para simplificar
+    # str en vez de EmailStr para simplificar; se recortan espacios en la validación.
+    # Sin pasar a minúsculas: el login compara users.email distinguiendo mayúsculas
+    email: Annotated[str, StringConstraints(strip_whitespace=True, max_length=100)]
     password: str
 
 class UserResponse(BaseModel):
+    model_config = ConfigDict(frozen=True, from_attributes=True)
+    
     id: int
     email: str
     first_name: str
@@ -17,6 +21,8 @@ class UserResponse(BaseModel):
     is_active: bool
 
 class Token(BaseModel):
+    model_config = ConfigDict(frozen=True, from_attributes=True)
+    
     access_token: str
     token_type: str
-    user: UserResponse
\ No newline at end of file
+    user: UserResponse
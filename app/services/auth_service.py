@@ -1,54 +1,61 @@
 # app/services/auth_service.py
+import asyncio
+import os
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-from app.core.database_sqlite import get_db
+from app.core.database_sqlite import get_read_db, get_write_db
 from app.core.security import verify_password, get_password_hash
 
+# SQL como constantes: el mismo string reutiliza la sentencia preparada en cada conexión
+AUTHENTICATE_USER_SQL = '''SELECT u.id, u.email, u.password_hash, u.first_name, u.last_name, 
+                                 u.role, u.location_id, u.is_active, l.name as location_name
+                          FROM users u 
+                          LEFT JOIN locations l ON u.location_id = l.id
+                          WHERE u.email = ? AND u.is_active = 1'''
+
+GET_USER_BY_ID_SQL = '''SELECT u.*, l.name as location_name 
+                       FROM users u 
+                       LEFT JOIN locations l ON u.location_id = l.id 
+                       WHERE u.id = ? AND u.is_active = 1'''
+
+INSERT_USER_SQL = '''INSERT INTO users (email, password_hash, first_name, last_name, role, location_id)
+                    VALUES (?, ?, ?, ?, ?, ?)'''
+
+# bcrypt libera el GIL: N verificaciones corren en paralelo en N núcleos
+bcrypt_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="bcrypt")
+
 class AuthService:
     
-    def authenticate_user(self, email: str, password: str) -> Optional[dict]:
+    async def authenticate_user(self, email: str, password: str) -> Optional[sqlite3.Row]:
         """Autenticar usuario"""
-        with get_db() as conn:
-            cursor = conn.execute(
-                '''SELECT u.id, u.email, u.password_hash, u.first_name, u.last_name, 
-                          u.role, u.location_id, u.is_active, l.name as location_name
-                   FROM users u 
-                   LEFT JOIN locations l ON u.location_id = l.id
-                   WHERE u.email = ? AND u.is_active = 1''',
-                (email,)
-            )
-            user = cursor.fetchone()
-            
-            if not user or not verify_password(password, user['password_hash']):
-                return None
-            
-            return dict(user)
+        # Liberar la conexión antes de verificar el password
+        with get_read_db() as conn:
+            user = conn.execute(AUTHENTICATE_USER_SQL, (email,)).fetchone()
+        
+        if not user:
+            return None
+        
+        password_ok = await asyncio.get_running_loop().run_in_executor(
+            bcrypt_executor, verify_password, password, user['password_hash']
+        )
+        return user if password_ok else None
     
-    def get_user_by_id(self, user_id: int) -> Optional[dict]:
+    def get_user_by_id(self, user_id: int) -> Optional[sqlite3.Row]:
         """Obtener usuario por ID"""
-        with get_db() as conn:
-            cursor = conn.execute(
-                '''SELECT u.*, l.name as location_name 
-                   FROM users u 
-                   LEFT JOIN locations l ON u.location_id = l.id 
-                   WHERE u.id = ? AND u.is_active = 1''',
-                (user_id,)
-            )
-            user = cursor.fetchone()
-            return dict(user) if user else None
+        with get_read_db() as conn:
+            return conn.execute(GET_USER_BY_ID_SQL, (user_id,)).fetchone()
     
-    def create_user(self, email: str, password: str, first_name: str, last_name: str, role: str = "seller", location_id: int = None) -> dict:
+    def create_user(self, email: str, password: str, first_name: str, last_name: str, role: str = "seller", location_id: int = None) -> sqlite3.Row:
         """Crear nuevo usuario"""
         password_hash = get_password_hash(password)
         
-        with get_db() as conn:
+        with get_write_db() as conn:
             cursor = conn.execute(
-                '''INSERT INTO users (email, password_hash, first_name, last_name, role, location_id)
-                   VALUES (?, ?, ?, ?, ?, ?)''',
+                INSERT_USER_SQL,
                 (email, password_hash, first_name, last_name, role, location_id)
             )
-            conn.commit()
-            
-            return self.get_user_by_id(cursor.lastrowid)
+        
+        return self.get_user_by_id(cursor.lastrowid)
 
 auth_service = AuthService()
\ No newline at end of file
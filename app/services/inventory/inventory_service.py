@@ -1,11 +1,21 @@
 # app/services/inventory/inventory_service.py
+import asyncio
+import copy
+import threading
 from typing import Dict, List
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.orm import Session, joinedload
+from cachetools import TTLCache
 
 from app.models.inventory import Inventory
 from app.models.sneaker import SneakerReference
-from app.models.user import Location
+
+# Inventario por (reference_code, location_id); TTL corto porque el stock cambia con ventas.
+# No se invalida al escribir: el TTL de 10s es el único límite de desactualización
+inventory_cache = TTLCache(maxsize=2048, ttl=10)
+
+def _session_lock(db: Session) -> threading.Lock:
+    """Lock por sesión: una Session no es thread-safe y las consultas corren en hilos"""
+    return db.info.setdefault("inventory_lock", threading.Lock())
 
 class InventoryService:
     
@@ -15,34 +25,47 @@ class InventoryService:
         user_location_id: int,
         db: Session
     ) -> Dict:
-        """Obtener inventario completo para una referencia"""
+        """Obtener inventario completo para una referencia (copia: el llamador puede modificarla)"""
+        
+        cache_key = (reference_code, user_location_id)
+        cached = inventory_cache.get(cache_key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+        
+        # El ORM es síncrono: consultar fuera del event loop
+        inventory_data = await asyncio.to_thread(
+            self._query_inventory_locked, reference_code, user_location_id, db
+        )
+        inventory_cache[cache_key] = inventory_data
+        return copy.deepcopy(inventory_data)
+    
+    def _query_inventory_locked(self, reference_code: str, user_location_id: int, db: Session) -> Dict:
+        """Consultar inventario serializando el acceso a la sesión"""
+        with _session_lock(db):
+            return self._query_inventory(reference_code, user_location_id, db)
+    
+    def _query_inventory(self, reference_code: str, user_location_id: int, db: Session) -> Dict:
+        """Consultar inventario en BD"""
         
-        # Buscar referencia del tenis
-        sneaker_ref = db.query(SneakerReference).filter(
+        # Referencia + inventario de todas las ubicaciones en una sola consulta
+        sneaker_ref = db.query(SneakerReference).options(
+            joinedload(SneakerReference.inventory).joinedload(Inventory.location)
+        ).filter(
             SneakerReference.reference_code == reference_code
-        ).first()
+        ).one_or_none()
         
         if not sneaker_ref:
             return self._empty_inventory_response()
         
-        # Inventario local
-        local_inventory = db.query(Inventory).filter(
-            and_(
-                Inventory.sneaker_reference_id == sneaker_ref.id,
-                Inventory.location_id == user_location_id
-            )
-        ).all()
-        
-        # Inventario en otras ubicaciones
-        other_inventory = db.query(Inventory, Location).join(
-            Location, Inventory.location_id == Location.id
-        ).filter(
-            and_(
-                Inventory.sneaker_reference_id == sneaker_ref.id,
-                Inventory.location_id != user_location_id,
-                Inventory.quantity_stock > 0
-            )
-        ).all()
+        # Separar inventario local y de otras ubicaciones en memoria
+        local_inventory = [
+            inv for inv in sneaker_ref.inventory
+            if inv.location_id == user_location_id
+        ]
+        other_inventory = [
+            (inv, inv.location) for inv in sneaker_ref.inventory
+            if inv.location_id != user_location_id and inv.quantity_stock > 0
+        ]
         
         return {
             "reference": {
@@ -2,18 +2,29 @@
 import sys
 import os
 import sqlite3
+import queue
+import threading
 import tempfile
 import random
 import asyncio
 import httpx
 import uuid
+import hashlib
+import hmac
+import logging
+import time
 from datetime import datetime, timedelta
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from fastapi import FastAPI, HTTPException, status, File, UploadFile, Depends , Form
+from fastapi import FastAPI, HTTPException, status, File, UploadFile, Depends , Form, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel
-from passlib.context import CryptContext
+from starlette.datastructures import Headers
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError
 from jose import jwt
 import cloudinary
 import cloudinary.uploader
@@ -22,9 +33,18 @@ import cloudinary.utils
 from cloudinary.exceptions import Error as CloudinaryError
 import io
 from PIL import Image
-from typing import Optional
-import json
-
+from typing import Annotated, Optional
+import orjson
+from cachetools import TTLCache
+
+# Eventos operativos (circuit breaker, errores con traceback); el resto del archivo usa print
+logger = logging.getLogger("tustockya")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
 
 # ==================== CONFIGURACIÓN PARA RAILWAY ====================
 
@@ -44,9 +64,22 @@ cloudinary.config(
 )
 
 CLOUDINARY_FOLDER = os.getenv("CLOUDINARY_FOLDER", "tustockya")
+# Carpetas de comprobantes precalculadas por tipo
+RECEIPT_FOLDERS = {
+    receipt_type: f"{CLOUDINARY_FOLDER}/receipts/{receipt_type}"
+    for receipt_type in ("sale", "expense")
+}
 ALLOWED_IMAGE_FORMATS = {"image/jpeg", "image/png", "image/webp", "image/jpg"}
 MAX_IMAGE_SIZE = 10 * 1024 * 1024  # ✅ AGREGAR ESTA LÍNEA: 10MB
 
+# Microservicio de clasificación: un solo cliente HTTP/2 con keep-alive para todos los escaneos
+CLASSIFY_URL = os.getenv("CLASSIFY_URL", "https://sneaker-api-v2.onrender.com/api/v2/classify")
+CLASSIFY_CLIENT = httpx.AsyncClient(
+    http2=True,
+    timeout=30.0,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+)
+
 
 
 # Configuración de base de datos
@@ -73,80 +106,221 @@ upload_dir = os.getenv("UPLOAD_DIR", "data/uploads")
 os.makedirs(upload_dir, exist_ok=True)
 
 ALGORITHM = "HS256"
+# Costo bcrypt para hashes nuevos (valores bajos solo para datos de prueba)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+@lru_cache(maxsize=1)
+def _pwd_context():
+    """CryptContext perezoso: passlib tarda en cargar backends y solo se usa en login"""
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
 try:
     import psycopg2
     import psycopg2.extras
+    import psycopg2.pool
     PSYCOPG2_AVAILABLE = True
 except ImportError:
     PSYCOPG2_AVAILABLE = False
     print("⚠️ psycopg2 no disponible - solo SQLite funcionará")
 
+# ==================== POOL DE CONEXIONES ====================
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "5"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+# Segundos que un request espera por una conexión libre antes de responder 503
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
+# ThreadedConnectionPool.getconn() falla en vez de esperar cuando está agotado: el semáforo hace la espera
+_pg_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+if PSYCOPG2_AVAILABLE:
+    class PreparedConnection(psycopg2.extensions.connection):
+        """Conexión que recuerda qué sentencias ya preparó en el servidor"""
+        
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared = set()
+        
+        def prepare(self, name: str, sql: str):
+            """PREPARE una sola vez por conexión: el plan queda guardado en la sesión"""
+            if name not in self.prepared:
+                with self.cursor() as cursor:
+                    cursor.execute(f"PREPARE {name} AS {sql}")
+                self.prepared.add(name)
+
+def execute_prepared(cursor, name: str, sql: str, params: tuple = ()):
+    """Ejecutar una sentencia preparada (sql con $1, $2...); se prepara en el primer uso de cada conexión"""
+    cursor.connection.prepare(name, sql)
+    if params:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+# Conexiones SQLite abiertas una vez y reutilizadas entre requests
+_sqlite_pool = queue.Queue()
+
+def _get_pg_pool():
+    """Pool de PostgreSQL, creado en el primer uso"""
+    global _pg_pool
+    if _pg_pool is None:
+        with _pg_pool_lock:
+            if _pg_pool is None:
+                _pg_pool = psycopg2.pool.ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, DB_PATH, connection_factory=PreparedConnection
+                )
+    return _pg_pool
+
+def _open_sqlite_connection():
+    """Abrir conexión SQLite configurada (WAL, filas tipo dict)"""
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def _acquire_connection():
+    """Tomar una conexión del pool, esperando hasta DB_POOL_TIMEOUT si está agotado (bloquea el hilo)"""
+    if USE_POSTGRESQL:
+        if not _pg_pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise HTTPException(status_code=503, detail="Base de datos ocupada, intenta de nuevo en unos segundos")
+        try:
+            return _get_pg_pool().getconn()
+        except BaseException:
+            _pg_pool_slots.release()
+            raise
+    try:
+        return _sqlite_pool.get_nowait()
+    except queue.Empty:
+        return _open_sqlite_connection()
+
+def _release_connection(conn):
+    """Devolver una conexión al pool sin transacciones abiertas"""
+    if USE_POSTGRESQL:
+        broken = bool(conn.closed)
+        if not broken:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        try:
+            # Las conexiones caídas se descartan en lugar de volver al pool
+            _get_pg_pool().putconn(conn, close=broken)
+        finally:
+            _pg_pool_slots.release()
+    else:
+        if conn.in_transaction:
+            conn.rollback()
+        _sqlite_pool.put(conn)
+
+@contextmanager
+def db_connection():
+    """Conexión tomada del pool; se devuelve al terminar sin transacciones abiertas"""
+    conn = _acquire_connection()
+    try:
+        yield conn
+    finally:
+        _release_connection(conn)
+
+def run_with_connection(func, *args):
+    """Ejecutar func(conn, *args) con una conexión del pool (bloqueante: llamar con asyncio.to_thread)"""
+    with db_connection() as conn:
+        return func(conn, *args)
+
 # ==================== SCHEMAS ====================
 
-class UserLogin(BaseModel):
+# Montos y cantidades validados por pydantic-core en la misma pasada del parseo
+PositiveAmount = Annotated[float, Field(gt=0)]
+PositiveQuantity = Annotated[int, Field(gt=0)]
+
+class RequestModel(BaseModel):
+    """Base de los schemas de entrada: inmutables y con strings normalizados"""
+    model_config = ConfigDict(frozen=True, str_strip_whitespace=True)
+
+class UserLogin(RequestModel):
     email: str
     password: str
 
 # Schemas para métodos de pago
-class PaymentMethod(BaseModel):
+class PaymentMethod(RequestModel):
     type: str  # 'efectivo', 'tarjeta', 'transferencia', 'mixto'
-    amount: float
-    reference: str = None  # Número de tarjeta (últimos 4), referencia transferencia, etc.
+    amount: PositiveAmount
+    reference: Optional[str] = None  # Número de tarjeta (últimos 4), referencia transferencia, etc.
 
 # Schemas para módulo seller completo
-class SaleCreateComplete(BaseModel):
-    items: list
-    total_amount: float
-    payment_methods: list[PaymentMethod]  # Puede ser múltiples métodos
-    receipt_image: str = None  # Foto del comprobante
-    notes: str = None
-    requires_confirmation: bool = False  # Si necesita confirmación posterior
-
-class SaleConfirmation(BaseModel):
+class SaleItem(RequestModel):
+    sneaker_reference_code: str
+    brand: str
+    model: str
+    color: Optional[str] = None
+    size: str
+    quantity: PositiveQuantity
+    unit_price: PositiveAmount
+
+# create_sale_complete recibe items y pagos como JSON en campos Form: se validan con estos adapters
+SALE_ITEMS_ADAPTER = TypeAdapter(list[SaleItem])
+PAYMENT_METHODS_ADAPTER = TypeAdapter(list[PaymentMethod])
+
+def parse_form_json(adapter: TypeAdapter, raw: str, field: str) -> list:
+    """Parsear y validar un campo Form JSON: JSON mal formado -> 400, esquema inválido -> 422"""
+    try:
+        return [model.model_dump() for model in adapter.validate_json(raw)]
+    except ValidationError as e:
+        errors = e.errors(include_url=False, include_context=False)
+        if errors[0]['type'] == 'json_invalid':
+            print(f"❌ [JSON] Error parseando {field}: {errors[0]['msg']}")
+            raise HTTPException(status_code=400, detail=f"Datos JSON inválidos: {errors[0]['msg']}")
+        print(f"❌ [VALIDATION] {field} inválidos: {e.error_count()} errores")
+        raise HTTPException(status_code=422, detail={field: errors})
+
+class SaleConfirmation(RequestModel):
     sale_id: int
     confirmed: bool
-    confirmation_notes: str = None
+    confirmation_notes: Optional[str] = None
 
-class ExpenseCreate(BaseModel):
+class ExpenseCreate(RequestModel):
     concept: str
-    amount: float
-    receipt_image: str = None  # Foto del comprobante
-    notes: str = None
+    amount: PositiveAmount
+    receipt_image: Optional[str] = None  # Foto del comprobante
+    notes: Optional[str] = None
 
-class TransferRequestComplete(BaseModel):
+class TransferRequestComplete(RequestModel):
     source_location_id: int
     sneaker_reference_code: str
     brand: str
     model: str
     size: str
-    quantity: int
+    quantity: PositiveQuantity
     purpose: str  # 'exhibition' o 'sale'
     pickup_type: str  # 'seller' o 'corredor'
     destination_type: str  # 'bodega' o 'exhibicion' - donde se guardará
-    notes: str = None
+    notes: Optional[str] = None
 
-class DiscountRequestCreate(BaseModel):
+class DiscountRequestCreate(RequestModel):
+    # Límites validados en el endpoint (mensajes específicos de negocio)
     amount: float
     reason: str
 
-class ReturnRequestCreate(BaseModel):
+class ReturnRequestCreate(RequestModel):
     original_transfer_id: int
-    notes: str = None
+    notes: Optional[str] = None
 
-class ReturnNotification(BaseModel):
+class ReturnNotification(RequestModel):
     transfer_request_id: int
     returned_to_location: str
     returned_at: str
-    notes: str = None
+    notes: Optional[str] = None
 
 # ==================== FUNCIONES DE SEGURIDAD ====================
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return _pwd_context().verify(plain_password, hashed_password)
+
+def get_password_hash(password: str) -> str:
+    return _pwd_context().hash(password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -154,14 +328,51 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+# Tokens ya verificados (por SHA-256 del token) y usuarios activos por id.
+# Ningún endpoint desactiva usuarios ni cambia roles o contraseñas: esos cambios se ven al vencer el TTL
+_token_cache = TTLCache(maxsize=10000, ttl=30)
+_user_cache = TTLCache(maxsize=5000, ttl=60)
+_auth_cache_lock = threading.Lock()
+
 def decode_token(token: str):
+    key = hashlib.sha256(token.encode()).digest()
+    with _auth_cache_lock:
+        payload = _token_cache.get(key)
+    
+    # El TTL del cache no debe extender la vida de un token ya expirado
+    if payload is not None and payload.get("exp", 0) > time.time():
+        return payload
+    
     try:
-        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except:
         return None
+    
+    with _auth_cache_lock:
+        _token_cache[key] = payload
+    return payload
 
 # ==================== DEPENDENCIAS ====================
 
+def _fetch_active_user(user_id: int):
+    """Leer usuario activo por id (bloqueante: llamar desde un hilo)"""
+    with db_connection() as conn:
+        if USE_POSTGRESQL:
+            # Usar PostgreSQL
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute(
+                "SELECT * FROM users WHERE id = %s AND is_active = TRUE", (user_id,)
+            )
+            user = cursor.fetchone()
+            cursor.close()
+        else:
+            # Usar SQLite
+            cursor = conn.execute(
+                "SELECT * FROM users WHERE id = ? AND is_active = 1", (user_id,)
+            )
+            user = cursor.fetchone()
+    return user
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     payload = decode_token(token)
@@ -173,32 +384,141 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     if not user_id:
         raise HTTPException(status_code=401, detail="Token inválido")
     
-    if USE_POSTGRESQL:
-        # Usar PostgreSQL
-        import psycopg2
-        import psycopg2.extras
-        
-        conn = psycopg2.connect(DB_PATH)
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute(
-            "SELECT * FROM users WHERE id = %s AND is_active = TRUE", (user_id,)
-        )
-        user = cursor.fetchone()
-        conn.close()
-    else:
-        # Usar SQLite
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.execute(
-            "SELECT * FROM users WHERE id = ? AND is_active = 1", (user_id,)
-        )
-        user = cursor.fetchone()
-        conn.close()
+    with _auth_cache_lock:
+        cached_user = _user_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
+    
+    # Solo se toma conexión del pool cuando el usuario no está en cache
+    user = await asyncio.to_thread(_fetch_active_user, user_id)
     
     if not user:
         raise HTTPException(status_code=401, detail="Usuario no encontrado")
     
-    return dict(user)
+    user = dict(user)
+    with _auth_cache_lock:
+        _user_cache[user_id] = user
+    return user
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Procesos para decodificar/redimensionar comprobantes (fuera del GIL)
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", os.cpu_count() or 1))
+
+async def read_upload_limited(file: UploadFile, max_size: int = MAX_IMAGE_SIZE) -> bytes:
+    """Leer un upload por bloques, cortando en cuanto supera max_size"""
+    too_large = HTTPException(status_code=413, detail=f"Archivo muy grande (máximo {max_size // (1024 * 1024)}MB)")
+    # Tamaño declarado por el cliente: rechazar sin leer nada
+    if file.size is not None and file.size > max_size:
+        raise too_large
+    
+    buffer = io.BytesIO()
+    total_size = 0
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        total_size += len(chunk)
+        if total_size > max_size:
+            raise too_large
+        buffer.write(chunk)
+    return buffer.getvalue()
+
+RECEIPT_MAX_DIMENSION = 1920
+# Filtro de reducción (BILINEAR por defecto: el JPEG q=85 posterior oculta la diferencia con LANCZOS)
+RESIZE_FILTER = Image.Resampling[os.getenv("RESIZE_FILTER", "BILINEAR").upper()]
+# JPEGs que ya caben se suben tal cual; Cloudinary aplica quality:auto en su lado
+RECEIPT_PASSTHROUGH_MAX_BYTES = 2 * 1024 * 1024
+
+def _resize_and_encode(content: bytes) -> bytes:
+    """Convertir a RGB, limitar dimensiones y recodificar como JPEG"""
+    with Image.open(io.BytesIO(content)) as img:
+        # JPEG: libjpeg decodifica directamente a escala reducida (1/2, 1/4, 1/8)
+        # sin bajar del tamaño objetivo; en otros formatos no hace nada
+        img.draft("RGB", (RECEIPT_MAX_DIMENSION, RECEIPT_MAX_DIMENSION))
+        
+        # Convertir a RGB si es necesario
+        if img.mode == "RGBA":
+            # Para RGBA, crear fondo blanco
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode in ("P", "LA"):
+            img = img.convert("RGB")
+        
+        # Redimensionar si es muy grande
+        if img.width > RECEIPT_MAX_DIMENSION or img.height > RECEIPT_MAX_DIMENSION:
+            ratio = min(RECEIPT_MAX_DIMENSION / img.width, RECEIPT_MAX_DIMENSION / img.height)
+            img = img.resize((int(img.width * ratio), int(img.height * ratio)), RESIZE_FILTER)
+        
+        # Guardar optimizada
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=85, optimize=True)
+        return output.getvalue()
+
+class CircuitBreaker:
+    """Tras fail_max fallos seguidos corta las llamadas durante reset_timeout segundos;
+    luego deja pasar una sola llamada de prueba (half-open)"""
+    
+    def __init__(self, name: str, fail_max: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+    
+    def is_open(self) -> bool:
+        """Circuito abierto: rechazar sin hacer trabajo previo (no reserva la llamada de prueba)"""
+        return self.state == "open"
+    
+    def allow(self) -> bool:
+        """¿Se puede intentar la llamada ahora?"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("[BREAKER] %s: circuito cerrado", self.name)
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            # Umbral alcanzado o prueba half-open fallida: (re)abrir
+            if self.opened_at is not None or self.failures >= self.fail_max:
+                if self.opened_at is None:
+                    logger.warning("[BREAKER] %s: circuito abierto tras %d fallos", self.name, self.failures)
+                self.opened_at = time.monotonic()
+    
+    def snapshot(self) -> dict:
+        return {"name": self.name, "state": self.state, "consecutive_failures": self.failures}
+
+class ReceiptUploadUnavailable(Exception):
+    """Cloudinary no respondió, falló o tiene el circuito abierto: la subida puede reintentarse"""
+
+# Límite para la llamada a Cloudinary dentro del request; el breaker corta tras fallos seguidos
+CLOUDINARY_UPLOAD_TIMEOUT = float(os.getenv("CLOUDINARY_UPLOAD_TIMEOUT", "10"))
+cloudinary_breaker = CircuitBreaker("cloudinary", fail_max=5, reset_timeout=30)
+# Hilos propios para el SDK: una subida colgada no ocupa el executor por defecto (auth, BD)
+CLOUDINARY_UPLOAD_WORKERS = int(os.getenv("CLOUDINARY_UPLOAD_WORKERS", "4"))
+_cloudinary_executor = ThreadPoolExecutor(max_workers=CLOUDINARY_UPLOAD_WORKERS, thread_name_prefix="cloudinary")
+RECEIPT_BACKFILL_ATTEMPTS = 3
 
 async def upload_receipt_to_cloudinary(
     file: UploadFile, 
@@ -217,6 +537,10 @@ async def upload_receipt_to_cloudinary(
         print(f"   Usuario ID: {user_id}")
         print(f"   Receipt type: {receipt_type}")
         
+        # Circuito abierto: cortar antes de leer y optimizar la imagen
+        if cloudinary_breaker.is_open():
+            raise ReceiptUploadUnavailable("Cloudinary no disponible (circuito abierto)")
+        
         # ✅ FIX 1: Verificar que el archivo tiene contenido
         if not file or not file.filename:
             raise Exception("Archivo vacío o sin nombre")
@@ -226,7 +550,7 @@ async def upload_receipt_to_cloudinary(
         
         # Leer contenido del archivo
         print(f"📖 [CLOUDINARY] Leyendo archivo...")
-        content = await file.read()
+        content = await read_upload_limited(file)
         file_size = len(content)
         
         print(f"   Tamaño leído: {file_size} bytes ({file_size/1024:.1f} KB)")
@@ -234,9 +558,6 @@ async def upload_receipt_to_cloudinary(
         if file_size == 0:
             raise Exception("Archivo vacío - 0 bytes leídos")
         
-        if file_size > MAX_IMAGE_SIZE:
-            raise Exception(f"Archivo muy grande: {file_size} bytes (máximo {MAX_IMAGE_SIZE})")
-        
         # ✅ FIX 3: Validar content-type más flexible
         valid_types = ["image/jpeg", "image/jpg", "image/png", "image/webp"]
         if file.content_type not in valid_types:
@@ -249,20 +570,18 @@ async def upload_receipt_to_cloudinary(
         # ✅ FIX 4: Verificar que es una imagen real
         print(f"🔍 [CLOUDINARY] Verificando formato de imagen...")
         try:
-            # Crear copia del contenido para verificación
-            content_copy = io.BytesIO(content)
-            img_test = Image.open(content_copy)
-            img_format = img_test.format
-            img_mode = img_test.mode
-            img_size = img_test.size
-            
-            print(f"   Formato detectado: {img_format}")
-            print(f"   Modo: {img_mode}")
-            print(f"   Dimensiones: {img_size[0]}x{img_size[1]}")
-            
-            # Cerrar imagen de test
-            img_test.close()
-            content_copy.close()
+            # Image.open solo lee la cabecera; la decodificación ocurre al optimizar
+            with Image.open(io.BytesIO(content)) as img:
+                print(f"   Formato detectado: {img.format}")
+                print(f"   Modo: {img.mode}")
+                print(f"   Dimensiones: {img.width}x{img.height}")
+                
+                already_fits = (
+                    img.format == "JPEG"
+                    and img.width <= RECEIPT_MAX_DIMENSION
+                    and img.height <= RECEIPT_MAX_DIMENSION
+                    and file_size <= RECEIPT_PASSTHROUGH_MAX_BYTES
+                )
             
         except Exception as e:
             print(f"❌ [CLOUDINARY] No es una imagen válida: {e}")
@@ -290,63 +609,35 @@ async def upload_receipt_to_cloudinary(
         
         # ✅ FIX 6: Optimización más robusta
         print(f"🔄 [CLOUDINARY] Optimizando imagen...")
-        try:
-            # Usar BytesIO para manejar el contenido
-            content_io = io.BytesIO(content)
-            img = Image.open(content_io)
-            
-            original_format = img.format
-            print(f"   Formato original: {original_format}")
-            print(f"   Tamaño original: {img.width}x{img.height}")
-            print(f"   Modo original: {img.mode}")
-            
-            # Convertir a RGB si es necesario
-            if img.mode in ("RGBA", "P", "LA"):
-                if img.mode == "RGBA":
-                    # Para RGBA, crear fondo blanco
-                    background = Image.new("RGB", img.size, (255, 255, 255))
-                    background.paste(img, mask=img.split()[-1] if img.mode == "RGBA" else None)
-                    img = background
-                else:
-                    img = img.convert("RGB")
-                print(f"   Convertido a RGB")
-            
-            # Redimensionar si es muy grande
-            max_dimension = 1920
-            if img.width > max_dimension or img.height > max_dimension:
-                ratio = min(max_dimension / img.width, max_dimension / img.height)
-                new_width = int(img.width * ratio)
-                new_height = int(img.height * ratio)
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                print(f"   Redimensionado a: {img.width}x{img.height}")
-            
-            # Guardar optimizada
-            output = io.BytesIO()
-            img.save(output, format='JPEG', quality=85, optimize=True)
-            optimized_content = output.getvalue()
-            
-            print(f"   Tamaño optimizado: {len(optimized_content)} bytes ({len(optimized_content)/1024:.1f} KB)")
-            print(f"   Compresión: {((len(content) - len(optimized_content)) / len(content) * 100):.1f}%")
-            
-            # Limpiar
-            img.close()
-            content_io.close()
-            output.close()
-            
-        except Exception as e:
-            print(f"⚠️ [CLOUDINARY] Error optimizando imagen: {e}")
-            print(f"   Usando imagen original...")
+        if already_fits:
+            # Sin decodificar ni recodificar: el original ya es un JPEG pequeño
+            print(f"   JPEG dentro de límites, se sube el original")
             optimized_content = content
+        else:
+            try:
+                # Decodificar/redimensionar/codificar en el pool de procesos (hilo si no hay pool)
+                optimized_content = await asyncio.get_running_loop().run_in_executor(
+                    getattr(app.state, "image_pool", None), _resize_and_encode, content
+                )
+                
+                print(f"   Tamaño optimizado: {len(optimized_content)} bytes ({len(optimized_content)/1024:.1f} KB)")
+                print(f"   Compresión: {((len(content) - len(optimized_content)) / len(content) * 100):.1f}%")
+                
+            except Exception as e:
+                print(f"⚠️ [CLOUDINARY] Error optimizando imagen: {e}")
+                print(f"   Usando imagen original...")
+                optimized_content = content
         
         # ✅ FIX 7: Generar nombres únicos más robustos
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
+        timestamp_ms = time.time_ns() // 1_000_000
+        unique_id = uuid.uuid4().hex[:8]
+        folder = RECEIPT_FOLDERS.get(receipt_type) or f"{CLOUDINARY_FOLDER}/receipts/{receipt_type}"
         
         # Obtener extensión del archivo original
         original_ext = os.path.splitext(file.filename)[1].lower() if file.filename else ""
         safe_filename = "".join(c for c in file.filename if c.isalnum() or c in "._-")[:20] if file.filename else "upload"
         
-        public_id = f"{CLOUDINARY_FOLDER}/receipts/{receipt_type}/{timestamp}_{user_id}_{unique_id}_{safe_filename}"
+        public_id = f"{folder}/{timestamp_ms}_{user_id}_{unique_id}_{safe_filename}"
         
         print(f"🆔 [CLOUDINARY] Public ID: {public_id}")
         
@@ -355,7 +646,7 @@ async def upload_receipt_to_cloudinary(
             "tustockya",
             receipt_type,
             f"user_{user_id}",
-            f"date_{datetime.now().strftime('%Y-%m-%d')}",
+            time.strftime("date_%Y-%m-%d"),
             f"original_{original_ext[1:]}" if original_ext else "unknown_format"
         ]
         if record_id:
@@ -369,7 +660,7 @@ async def upload_receipt_to_cloudinary(
         upload_params = {
             "public_id": public_id,
             "tags": tags,
-            "folder": f"{CLOUDINARY_FOLDER}/receipts/{receipt_type}",
+            "folder": folder,
             "resource_type": "image",
             "format": "jpg",  # Forzar JPG
             "quality": "auto:good",
@@ -384,10 +675,29 @@ async def upload_receipt_to_cloudinary(
         
         print(f"📤 [CLOUDINARY] Parámetros de upload: {upload_params}")
         
-        upload_result = cloudinary.uploader.upload(
-            optimized_content,
-            **upload_params
-        )
+        # Half-open: solo una llamada de prueba pasa (se reserva aquí, justo antes de la red)
+        if not cloudinary_breaker.allow():
+            raise ReceiptUploadUnavailable("Cloudinary no disponible (circuito abierto)")
+        
+        # El SDK es síncrono: sube en su propio pool de hilos y con timeout de socket, así el hilo
+        # también termina cuando wait_for deja de esperar
+        try:
+            upload_result = await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(
+                    _cloudinary_executor,
+                    partial(cloudinary.uploader.upload, optimized_content,
+                            timeout=CLOUDINARY_UPLOAD_TIMEOUT, **upload_params)
+                ),
+                timeout=CLOUDINARY_UPLOAD_TIMEOUT
+            )
+        except asyncio.CancelledError:
+            cloudinary_breaker.record_failure()
+            raise
+        except Exception as e:
+            cloudinary_breaker.record_failure()
+            reason = f"sin respuesta en {CLOUDINARY_UPLOAD_TIMEOUT}s" if isinstance(e, asyncio.TimeoutError) else str(e)
+            raise ReceiptUploadUnavailable(f"Error subiendo a Cloudinary: {reason}") from e
+        cloudinary_breaker.record_success()
         
         print(f"✅ [CLOUDINARY] Upload exitoso!")
         print(f"   URL: {upload_result['secure_url']}")
@@ -399,6 +709,10 @@ async def upload_receipt_to_cloudinary(
         
         return upload_result["secure_url"]
         
+    except ReceiptUploadUnavailable as e:
+        print(f"⚠️ [CLOUDINARY] {e}")
+        raise
+        
     except CloudinaryError as e:
         print(f"❌ [CLOUDINARY] Error específico de Cloudinary:")
         print(f"   Tipo: {type(e).__name__}")
@@ -423,6 +737,40 @@ async def upload_receipt_to_cloudinary(
         raise Exception(f"Error procesando imagen: {str(e)}")
 
 
+def _set_sale_receipt(sale_id: int, receipt_url: str):
+    """Asociar a una venta el comprobante subido en segundo plano"""
+    with db_connection() as conn:
+        if USE_POSTGRESQL:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE sales SET receipt_image = %s WHERE id = %s', (receipt_url, sale_id))
+            cursor.close()
+        else:
+            conn.execute('UPDATE sales SET receipt_image = ? WHERE id = ?', (receipt_url, sale_id))
+        conn.commit()
+
+async def backfill_sale_receipt(sale_id: int, user_id: int, content: bytes, filename: str, content_type: str):
+    """Reintentar en segundo plano la subida de un comprobante de venta que no pudo subirse en el request"""
+    for attempt in range(1, RECEIPT_BACKFILL_ATTEMPTS + 1):
+        # Dar tiempo a que el breaker pase a half-open antes de probar
+        await asyncio.sleep(cloudinary_breaker.reset_timeout)
+        upload = UploadFile(
+            io.BytesIO(content),
+            size=len(content),
+            filename=filename,
+            headers=Headers({"content-type": content_type or "image/jpeg"})
+        )
+        try:
+            receipt_url = await upload_receipt_to_cloudinary(upload, "sale", user_id, record_id=str(sale_id))
+        except Exception as e:
+            print(f"⚠️ [CLOUDINARY] Reintento {attempt}/{RECEIPT_BACKFILL_ATTEMPTS} del comprobante de la venta {sale_id}: {e}")
+            continue
+        
+        await asyncio.to_thread(_set_sale_receipt, sale_id, receipt_url)
+        print(f"✅ [CLOUDINARY] Comprobante de la venta {sale_id} asociado en segundo plano")
+        return
+    
+    print(f"❌ [CLOUDINARY] Comprobante de la venta {sale_id} descartado tras {RECEIPT_BACKFILL_ATTEMPTS} intentos")
+
 def validate_cloudinary_config() -> bool:
     """Verificar que Cloudinary está configurado correctamente - VERSIÓN CORREGIDA"""
     required_vars = ["CLOUDINARY_CLOUD_NAME", "CLOUDINARY_API_KEY", "CLOUDINARY_API_SECRET"]
@@ -451,12 +799,9 @@ def validate_cloudinary_config() -> bool:
         print(f"❌ Error conectando a Cloudinary: {e}")
         return False
 
-def get_sale_items(sale_id: int) -> list:
+def get_sale_items(conn, sale_id: int) -> list:
     """Obtener items de una venta específica (función auxiliar)"""
     if USE_POSTGRESQL:
-        import psycopg2
-        import psycopg2.extras
-        conn = psycopg2.connect(DB_PATH)
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
         cursor.execute(
@@ -464,19 +809,15 @@ def get_sale_items(sale_id: int) -> list:
             (sale_id,)
         )
         items = [dict(row) for row in cursor.fetchall()]
+        cursor.close()
     else:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        
         cursor = conn.execute(
             'SELECT * FROM sale_items WHERE sale_id = ?',
             (sale_id,)
         )
         items = [dict(row) for row in cursor.fetchall()]
     
-    conn.close()
-    
-    # Convertir al formato esperado por update_stock_after_sale
+    # Convertir al formato esperado por checkout_stock
     formatted_items = []
     for item in items:
         formatted_items.append({
@@ -487,13 +828,52 @@ def get_sale_items(sale_id: int) -> list:
     
     return formatted_items
 
+# Sentencias frecuentes de PostgreSQL: texto fijo a nivel de módulo, preparadas una vez por conexión
+SALE_ITEMS_BY_SALES_SQL = 'SELECT * FROM sale_items WHERE sale_id = ANY($1) ORDER BY id'
+SALE_PAYMENTS_BY_SALES_SQL = 'SELECT * FROM sale_payments WHERE sale_id = ANY($1) ORDER BY id'
+
+def attach_sale_details(conn, sales: list) -> list:
+    """Agregar items y métodos de pago a cada venta con una consulta por tabla (sin N+1)"""
+    items_by_sale = defaultdict(list)
+    payments_by_sale = defaultdict(list)
+    sale_ids = [sale['id'] for sale in sales]
+    
+    if sale_ids:
+        if USE_POSTGRESQL:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            execute_prepared(cursor, "sale_items_by_sales", SALE_ITEMS_BY_SALES_SQL, (sale_ids,))
+            item_rows = cursor.fetchall()
+            execute_prepared(cursor, "sale_payments_by_sales", SALE_PAYMENTS_BY_SALES_SQL, (sale_ids,))
+            payment_rows = cursor.fetchall()
+            cursor.close()
+        else:
+            placeholders = ','.join('?' * len(sale_ids))
+            item_rows = conn.execute(
+                f'SELECT * FROM sale_items WHERE sale_id IN ({placeholders}) ORDER BY id', sale_ids
+            ).fetchall()
+            payment_rows = conn.execute(
+                f'SELECT * FROM sale_payments WHERE sale_id IN ({placeholders}) ORDER BY id', sale_ids
+            ).fetchall()
+        
+        for row in item_rows:
+            items_by_sale[row['sale_id']].append(dict(row))
+        for row in payment_rows:
+            payments_by_sale[row['sale_id']].append(dict(row))
+    
+    for sale in sales:
+        sale['items'] = items_by_sale[sale['id']]
+        sale['payment_methods'] = payments_by_sale[sale['id']]
+    
+    return sales
+
 # ==================== CONFIGURACIÓN FASTAPI ====================
 
 app = FastAPI(
     title="TuStockYa Backend - Railway Ready",
     version="1.0.0",
     docs_url="/docs",
-    description="Sistema completo para gestión de inventario de tenis con módulo seller completo - Railway Compatible"
+    description="Sistema completo para gestión de inventario de tenis con módulo seller completo - Railway Compatible",
+    default_response_class=ORJSONResponse
 )
 
 # CORS mejorado para Railway
@@ -511,6 +891,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def start_image_pool():
+    """Pool de procesos para el procesamiento de imágenes, compartido por todos los requests"""
+    app.state.image_pool = ProcessPoolExecutor(max_workers=IMAGE_POOL_WORKERS)
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """Cerrar conexiones keep-alive al apagar"""
+    await CLASSIFY_CLIENT.aclose()
+
+@app.on_event("shutdown")
+async def stop_image_pool():
+    """Terminar los pools de imagen y de subidas a Cloudinary al apagar"""
+    image_pool = getattr(app.state, "image_pool", None)
+    if image_pool is not None:
+        image_pool.shutdown(wait=False, cancel_futures=True)
+    _cloudinary_executor.shutdown(wait=False, cancel_futures=True)
+
 # ==================== ENDPOINTS BÁSICOS ====================
 
 @app.get("/")
@@ -535,25 +933,27 @@ async def root():
         ]
     }
 
-@app.get("/health")
-async def health():
-    try:
+def _health_db_stats():
+    """Conteo de usuarios y listado de tablas (bloqueante: llamar desde un hilo)"""
+    with db_connection() as conn:
         if USE_POSTGRESQL:
-            import psycopg2
-            conn = psycopg2.connect(DB_PATH)
             cursor = conn.cursor()
             cursor.execute("SELECT COUNT(*) FROM users")
             user_count = cursor.fetchone()[0]
             cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
             tables = [row[0] for row in cursor.fetchall()]
-            conn.close()
+            cursor.close()
         else:
-            conn = sqlite3.connect(DB_PATH)
             cursor = conn.execute("SELECT COUNT(*) FROM users")
             user_count = cursor.fetchone()[0]
             cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
             tables = [row[0] for row in cursor.fetchall()]
-            conn.close()
+    return user_count, tables
+
+@app.get("/health")
+async def health():
+    try:
+        user_count, tables = await asyncio.to_thread(_health_db_stats)
         
         db_status = "connected"
     except Exception as e:
@@ -584,16 +984,38 @@ async def health():
 
 # ==================== AUTENTICACIÓN ====================
 
-@app.post("/api/v1/auth/login")
-async def login(credentials: UserLogin):
-    """Login de usuario"""
+# Logins correctos recientes: evita repetir bcrypt en reconexiones de clientes móviles.
+# La clave HMAC vive solo en memoria, así el cache nunca contiene algo reutilizable fuera del proceso.
+_login_cache = TTLCache(maxsize=1000, ttl=60)
+_LOGIN_CACHE_KEY = os.urandom(32)
+
+async def verify_login_password(plain_password: str, hashed_password: str) -> bool:
+    """Verificar contraseña con cache de aciertos; bcrypt corre fuera del event loop"""
+    # Incluir el hash completo: un cambio de contraseña invalida la entrada
+    key = hmac.new(
+        _LOGIN_CACHE_KEY,
+        plain_password.encode() + b"\0" + hashed_password.encode(),
+        hashlib.sha256
+    ).digest()
+    with _auth_cache_lock:
+        if key in _login_cache:
+            return True
+    
+    if not await asyncio.to_thread(verify_password, plain_password, hashed_password):
+        return False
     
+    with _auth_cache_lock:
+        _login_cache[key] = True
+    return True
+
+def _fetch_login_user(email: str):
+    """Leer usuario activo por email con su ubicación (bloqueante: llamar desde un hilo)"""
+    with db_connection() as conn:
+        return _query_login_user(conn, email)
+
+def _query_login_user(conn, email: str):
     if USE_POSTGRESQL:
         # Usar PostgreSQL
-        import psycopg2
-        import psycopg2.extras
-        
-        conn = psycopg2.connect(DB_PATH)
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
         cursor.execute(
@@ -601,26 +1023,30 @@ async def login(credentials: UserLogin):
                FROM users u 
                LEFT JOIN locations l ON u.location_id = l.id
                WHERE u.email = %s AND u.is_active = TRUE''',  # ✅ TRUE en lugar de 1
-            (credentials.email,)
+            (email,)
         )
         user = cursor.fetchone()
-        conn.close()
+        cursor.close()
     else:
         # Usar SQLite
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        
         cursor = conn.execute(
             '''SELECT u.*, l.name as location_name 
                FROM users u 
                LEFT JOIN locations l ON u.location_id = l.id
                WHERE u.email = ? AND u.is_active = 1''',  # ✅ 1 para SQLite
-            (credentials.email,)
+            (email,)
         )
         user = cursor.fetchone()
-        conn.close()
+    return dict(user) if user else None
+
+@app.post("/api/v1/auth/login")
+async def login(credentials: UserLogin):
+    """Login de usuario"""
     
-    if not user or not verify_password(credentials.password, user['password_hash']):
+    # La conexión vuelve al pool antes de verificar bcrypt (cientos de ms de CPU)
+    user = await asyncio.to_thread(_fetch_login_user, credentials.email)
+    
+    if not user or not await verify_login_password(credentials.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="Email o contraseña incorrectos")
     
     access_token = create_access_token(data={"user_id": user['id']})
@@ -656,116 +1082,129 @@ async def get_me(current_user = Depends(get_current_user)):
 
 # ==================== CLASIFICACIÓN ====================
 
-def validate_stock_availability(items, location_id):
-    """Validar que hay stock suficiente para todos los items"""
+# Nombres de ubicación por id: cambian muy poco y se consultan en cada venta.
+# Ningún endpoint crea ni renombra ubicaciones: un cambio directo en la base se ve al vencer el TTL
+_location_names = TTLCache(maxsize=1000, ttl=300)
+_location_names_lock = threading.Lock()
+
+def get_location_name(conn, location_id) -> Optional[str]:
+    """Nombre de una ubicación (cacheado en proceso tras la primera consulta)"""
+    with _location_names_lock:
+        name = _location_names.get(location_id)
+    if name is not None:
+        return name
+    
     if USE_POSTGRESQL:
-        conn = psycopg2.connect(DB_PATH)
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor = conn.cursor()
+        cursor.execute('SELECT name FROM locations WHERE id = %s', (location_id,))
+        row = cursor.fetchone()
+        cursor.close()
     else:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
+        row = conn.execute('SELECT name FROM locations WHERE id = ?', (location_id,)).fetchone()
     
-    stock_issues = []
-    
-    for item in items:
-        if USE_POSTGRESQL:
-            cursor.execute('''
-                SELECT ps.quantity 
-                FROM product_sizes ps
-                JOIN products p ON ps.product_id = p.id
-                WHERE p.reference_code = %s 
-                AND ps.size = %s 
-                AND p.location_name = (SELECT name FROM locations WHERE id = %s)
-            ''', (item['sneaker_reference_code'], item['size'], location_id))
-        else:
-            cursor.execute('''
-                SELECT ps.quantity 
-                FROM product_sizes ps
-                JOIN products p ON ps.product_id = p.id
-                WHERE p.reference_code = ? 
-                AND ps.size = ? 
-                AND p.location_name = (SELECT name FROM locations WHERE id = ?)
-            ''', (item['sneaker_reference_code'], item['size'], location_id))
-        
-        result = cursor.fetchone()
-        available_qty = result['quantity'] if result else 0
+    if row is None:
+        return None
+    with _location_names_lock:
+        _location_names[location_id] = row[0]
+    return row[0]
 
-        print(available_qty)
-        
-        if available_qty < item['quantity']:
-            stock_issues.append({
-                "reference": item['sneaker_reference_code'],
-                "size": item['size'],
-                "requested": item['quantity'],
-                "available": available_qty
-            })
-    
-    conn.close()
-    return stock_issues
+# Rechazar ventas sin stock suficiente (desactivado: hoy la venta se registra igual)
+VALIDATE_STOCK_ON_SALE = os.getenv("VALIDATE_STOCK_ON_SALE", "false").lower() == "true"
 
-def get_db_connection_inventory():
-    """Obtener conexión para inventario real"""
-    if DATABASE_URL.startswith("sqlite"):
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn, "sqlite"
-    else:
-        if not PSYCOPG2_AVAILABLE:
-            raise Exception("psycopg2 no está disponible para PostgreSQL")
-        
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn, "postgresql"
+CHECKOUT_UPDATE_STOCK_SQL = 'UPDATE product_sizes SET quantity = quantity - $1 WHERE id = $2'
 
-def update_stock_after_sale(items, location_id):
-    """Descontar stock después de confirmar venta"""
+def checkout_stock(conn, items, location_id, validate: bool = True) -> list:
+    """
+    Bloquear, validar y descontar el stock de los items en la transacción en curso.
+    No hace commit: el llamador confirma junto con la venta. Devuelve los faltantes
+    (si validate=True y hay faltantes no se descuenta nada).
+    """
+    # Agrupar por (referencia, talla): varias líneas del mismo producto suman
+    quantities = {}
+    for item in items:
+        key = (item['sneaker_reference_code'], item['size'])
+        quantities[key] = quantities.get(key, 0) + item['quantity']
+    
+    if not quantities:
+        return []
+    
+    pairs = tuple(quantities)
+    location_name = get_location_name(conn, location_id)
+    
     if USE_POSTGRESQL:
-        conn = psycopg2.connect(DB_PATH)
         cursor = conn.cursor()
+        # FOR UPDATE: nadie más puede vender estas tallas hasta el commit (sin sobreventa)
+        cursor.execute('''
+            SELECT ps.id, p.reference_code, ps.size, ps.quantity 
+            FROM product_sizes ps
+            JOIN products p ON ps.product_id = p.id
+            WHERE p.location_name = %s
+            AND (p.reference_code, ps.size) IN %s
+            ORDER BY ps.id
+            FOR UPDATE OF ps
+        ''', (location_name, pairs))
+        rows = cursor.fetchall()
     else:
-        conn = sqlite3.connect(DB_PATH)
+        # SQLite: la venta ya abrió una transacción de escritura, que serializa a los demás escritores
+        values = ", ".join(["(?, ?)"] * len(pairs))
+        rows = conn.execute(f'''
+            SELECT ps.id, p.reference_code, ps.size, ps.quantity 
+            FROM product_sizes ps
+            JOIN products p ON ps.product_id = p.id
+            WHERE p.location_name = ?
+            AND (p.reference_code, ps.size) IN (VALUES {values})
+            ORDER BY ps.id
+        ''', (location_name, *[value for pair in pairs for value in pair])).fetchall()
+    
+    # Una sola fila por (referencia, talla): la de menor id (las filas vienen ordenadas por id).
+    # Si hay duplicados, esa fila es la que se valida y la única que se descuenta
+    size_ids = {}
+    available = {}
+    for size_id, reference_code, size, quantity in rows:
+        if (reference_code, size) not in size_ids:
+            size_ids[(reference_code, size)] = size_id
+            available[(reference_code, size)] = quantity
+    
+    stock_issues = [
+        {
+            "reference": reference_code,
+            "size": size,
+            "requested": requested,
+            "available": available.get((reference_code, size), 0)
+        }
+        for (reference_code, size), requested in quantities.items()
+        if available.get((reference_code, size), 0) < requested
+    ]
+    if validate and stock_issues:
+        if USE_POSTGRESQL:
+            cursor.close()
+        return stock_issues
     
-    try:
-        for item in items:
-            if USE_POSTGRESQL:
-                cursor.execute('''
-                    UPDATE product_sizes 
-                    SET quantity = quantity - %s
-                    WHERE product_id = (
-                        SELECT p.id FROM products p 
-                        WHERE p.reference_code = %s 
-                        AND p.location_name = (SELECT name FROM locations WHERE id = %s)
-                    ) 
-                    AND size = %s
-                ''', (item['quantity'], item['sneaker_reference_code'], location_id, item['size']))
-            else:
-                conn.execute('''
-                    UPDATE product_sizes 
-                    SET quantity = quantity - ?
-                    WHERE product_id = (
-                        SELECT p.id FROM products p 
-                        WHERE p.reference_code = ? 
-                        AND p.location_name = (SELECT name FROM locations WHERE id = ?)
-                    ) 
-                    AND size = ?
-                ''', (item['quantity'], item['sneaker_reference_code'], location_id, item['size']))
-        
-        conn.commit()
-        return True
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    updates = [(quantities[key], size_id) for key, size_id in size_ids.items()]
+    if USE_POSTGRESQL:
+        if updates:
+            # execute_batch agrupa las sentencias en pocos viajes; EXECUTE evita re-planificar cada una
+            conn.prepare("checkout_update_stock", CHECKOUT_UPDATE_STOCK_SQL)
+            psycopg2.extras.execute_batch(
+                cursor, "EXECUTE checkout_update_stock (%s, %s)", updates, page_size=100
+            )
+        cursor.close()
+    elif updates:
+        conn.executemany('UPDATE product_sizes SET quantity = quantity - ? WHERE id = ?', updates)
+    
+    return stock_issues
 
-def search_products_in_real_inventory(model_name: str, limit: int = 5):
+def search_products_in_real_inventory(conn, model_name: str, limit: int = 5):
     """Buscar productos en el inventario real basado en el model_name del microservicio"""
     try:
-        conn, db_type = get_db_connection_inventory()
-        
-        if db_type == "sqlite":
+        if not USE_POSTGRESQL:
             cursor = conn.execute('''
                 SELECT p.*, 
-                       GROUP_CONCAT(ps.size || '/' || ps.quantity) as sizes_stock,
+                       json_group_array(json_object(
+                           'size', ps.size,
+                           'quantity_stock', ps.quantity,
+                           'quantity_exhibition', COALESCE(ps.quantity_exhibition, 0)
+                       )) FILTER (WHERE ps.product_id IS NOT NULL) as parsed_stock,
                        SUM(ps.quantity) as total_available,
                        SUM(ps.quantity_exhibition) as total_exhibition
                 FROM products p
@@ -778,11 +1217,18 @@ def search_products_in_real_inventory(model_name: str, limit: int = 5):
             ''', (f'%{model_name}%', f'%{model_name}%', f'%{model_name}%', limit))
             
             products = [dict(row) for row in cursor.fetchall()]
+            # SQLite devuelve el arreglo JSON como texto
+            for product in products:
+                product['parsed_stock'] = orjson.loads(product['parsed_stock'] or '[]')
         else:
             cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
             cursor.execute('''
                 SELECT p.*, 
-                       STRING_AGG(ps.size || '/' || ps.quantity, ',') as sizes_stock,
+                       COALESCE(json_agg(json_build_object(
+                           'size', ps.size,
+                           'quantity_stock', ps.quantity,
+                           'quantity_exhibition', COALESCE(ps.quantity_exhibition, 0)
+                       )) FILTER (WHERE ps.product_id IS NOT NULL), '[]') as parsed_stock,
                        SUM(ps.quantity) as total_available,
                        SUM(ps.quantity_exhibition) as total_exhibition
                 FROM products p
@@ -796,56 +1242,53 @@ def search_products_in_real_inventory(model_name: str, limit: int = 5):
                 LIMIT %s
             ''', (f'%{model_name}%', f'%{model_name}%', f'%{model_name}%', limit))
             
+            # psycopg2 ya convierte json a listas de dicts
             products = [dict(row) for row in cursor.fetchall()]
             cursor.close()
         
-        conn.close()
-        
-        # Procesar datos para formato del API
+        # Agregar la ubicación a cada talla (formato del API)
         for product in products:
-            # Parsear tallas
-            if product.get('sizes_stock'):
-                size_pairs = product['sizes_stock'].split(',')
-                stock_by_size = []
-                for pair in size_pairs:
-                    if '/' in pair:
-                        size, qty = pair.split('/')
-                        stock_by_size.append({
-                            "size": size,
-                            "quantity_stock": int(qty),
-                            "quantity_exhibition": 0,  # Se puede mejorar
-                            "location": product['location_name']
-                        })
-                product['parsed_stock'] = stock_by_size
-            else:
-                product['parsed_stock'] = []
+            for size_stock in product['parsed_stock']:
+                size_stock['location'] = product['location_name']
         
         return products
         
     except Exception as e:
         print(f"Error buscando en inventario real: {e}")
+        # No dejar la transacción abortada en la conexión
+        conn.rollback()
         return []
 
+# Respuestas del microservicio por hash de la imagen: reintentos y re-escaneos no repiten la llamada
+_scan_cache = TTLCache(maxsize=1000, ttl=300)
+
 async def call_real_classification_service(image_content: bytes, filename: str):
     """Llamar a tu microservicio real de clasificación"""
+    # blake2b: hash rápido, no se necesita resistencia criptográfica para este uso
+    cache_key = hashlib.blake2b(image_content, digest_size=16).digest()
+    cached_result = _scan_cache.get(cache_key)
+    if cached_result is not None:
+        print(f"⚡ Clasificación desde cache")
+        return cached_result
+    
     try:
-        # Tu endpoint real
-        classification_url = "https://sneaker-api-v2.onrender.com/api/v2/classify"
-        
         # Preparar archivo para upload
         files = {
             "image": (filename, image_content, "image/jpeg")
         }
         
-        # Llamada al microservicio
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(classification_url, files=files)
-            response.raise_for_status()
-            
-            classification_result = response.json()
-            print(f"🤖 Respuesta del microservicio: {classification_result.get('total_matches_found', 0)} matches")
-            
-            return classification_result
+        # Llamada al microservicio (conexión reutilizada)
+        response = await CLASSIFY_CLIENT.post(CLASSIFY_URL, files=files)
+        response.raise_for_status()
+        
+        classification_result = response.json()
+        print(f"🤖 Respuesta del microservicio: {classification_result.get('total_matches_found', 0)} matches")
+        
+        # Solo se cachean respuestas exitosas
+        if classification_result.get('success'):
+            _scan_cache[cache_key] = classification_result
+        
+        return classification_result
             
     except httpx.TimeoutException:
         print("⏰ Timeout en microservicio de clasificación")
@@ -857,19 +1300,35 @@ async def call_real_classification_service(image_content: bytes, filename: str):
         print(f"❌ Error llamando microservicio: {e}")
         return None
 
-def merge_classification_with_inventory(classification_result, user_location_id):
+def _search_inventory_models(model_names: list, limit: int) -> dict:
+    """Buscar varios modelos en el inventario con una sola conexión del pool (bloqueante: llamar desde un hilo)"""
+    try:
+        with db_connection() as conn:
+            return {
+                model_name: search_products_in_real_inventory(conn, model_name, limit)
+                for model_name in model_names
+            }
+    except HTTPException as e:
+        # Pool agotado (503): el escaneo sigue sin datos de inventario
+        print(f"⚠️ Inventario no disponible para el escaneo: {e.detail}")
+        return {}
+
+async def merge_classification_with_inventory(classification_result, user_location_id):
     """Combinar resultados de clasificación con inventario real"""
     if not classification_result or not classification_result.get('results'):
         return []
     
     merged_results = []
+    top_results = classification_result['results'][:3]  # Top 3
     
-    for rank, result in enumerate(classification_result['results'][:3], 1):  # Top 3
+    # Una búsqueda por modelo distinto, todas sobre la misma conexión y fuera del event loop
+    model_names = list(dict.fromkeys(result.get('model_name', '') for result in top_results))
+    products_by_model = await asyncio.to_thread(_search_inventory_models, model_names, 2)
+    real_products_by_rank = [products_by_model.get(result.get('model_name', ''), []) for result in top_results]
+    
+    for rank, (result, real_products) in enumerate(zip(top_results, real_products_by_rank), 1):
         model_name = result.get('model_name', '')
         
-        # Buscar en inventario real
-        real_products = search_products_in_real_inventory(model_name, limit=2)
-        
         if real_products:
             # Usar datos reales si se encuentran
             for real_product in real_products:
@@ -973,9 +1432,7 @@ async def scan_sneaker_integrated(
     if not image.content_type or not image.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="El archivo debe ser una imagen")
     
-    content = await image.read()
-    if len(content) > 10 * 1024 * 1024:
-        raise HTTPException(status_code=413, detail="Archivo muy grande (máximo 10MB)")
+    content = await read_upload_limited(image)
     
     print(f"🔍 Iniciando escaneo con microservicio real...")
     
@@ -986,7 +1443,9 @@ async def scan_sneaker_integrated(
         print(f"✅ Microservicio respondió: {classification_result.get('total_matches_found', 0)} matches")
         
         # Combinar con inventario real
-        merged_results = merge_classification_with_inventory(classification_result, current_user['location_id'])
+        merged_results = await merge_classification_with_inventory(
+            classification_result, current_user['location_id']
+        )
         
         processing_time = (datetime.now() - start_time).total_seconds() * 1000
         
@@ -1012,7 +1471,7 @@ async def scan_sneaker_integrated(
             },
             "classification_service": {
                 "service": "real_microservice",
-                "url": "https://sneaker-api-v2.onrender.com/api/v2/classify",
+                "url": CLASSIFY_URL,
                 "model": classification_result.get('model_info', {}).get('model', 'jina-clip-v2'),
                 "total_database_matches": classification_result.get('total_matches_found', 0)
             },
@@ -1108,90 +1567,137 @@ async def classification_health():
 
 # ==================== MÓDULO seller COMPLETO ====================
 
+# Dashboard del seller en PostgreSQL: seis agregados resueltos en una sola consulta.
+# Ventas, pagos y gastos del día salen de las tablas *_daily_summary (una búsqueda por PK)
+VENDOR_DASHBOARD_SUMMARY_CTES = '''
+    WITH sales_today AS (
+        SELECT 
+          COALESCE(SUM(total_sales), 0) as total_sales,
+          COALESCE(SUM(confirmed_amount), 0) as confirmed_amount,
+          COALESCE(SUM(pending_amount), 0) as pending_amount,
+          COALESCE(SUM(pending_confirmations), 0) as pending_confirmations
+        FROM sales_daily_summary
+        WHERE seller_id = $1 AND sale_date = CURRENT_DATE
+    ), payment_methods AS (
+        SELECT payment_type, total_amount, count
+        FROM sale_payments_daily_summary
+        WHERE seller_id = $1 AND sale_date = CURRENT_DATE AND count > 0
+    ), expenses_today AS (
+        SELECT COALESCE(SUM(count), 0) as count, COALESCE(SUM(total), 0) as total
+        FROM expenses_daily_summary
+        WHERE user_id = $1 AND expense_date = CURRENT_DATE
+'''
+
+# Mismos agregados calculados sobre las tablas base (si los resúmenes no pudieron crearse)
+VENDOR_DASHBOARD_LIVE_CTES = '''
+    WITH sales_today AS (
+        SELECT 
+          COUNT(*) as total_sales,
+          COALESCE(SUM(CASE WHEN confirmed THEN total_amount ELSE 0 END), 0) as confirmed_amount,
+          COALESCE(SUM(CASE WHEN NOT confirmed AND requires_confirmation THEN total_amount ELSE 0 END), 0) as pending_amount,
+          COUNT(CASE WHEN NOT confirmed AND requires_confirmation THEN 1 END) as pending_confirmations
+        FROM sales 
+        WHERE seller_id = $1 AND sale_date >= CURRENT_DATE AND sale_date < CURRENT_DATE + 1
+    ), payment_methods AS (
+        SELECT sp.payment_type, SUM(sp.amount) as total_amount, COUNT(*) as count
+        FROM sale_payments sp
+        JOIN sales s ON sp.sale_id = s.id
+        WHERE s.seller_id = $1 AND s.sale_date >= CURRENT_DATE AND s.sale_date < CURRENT_DATE + 1 AND s.confirmed
+        GROUP BY sp.payment_type
+    ), expenses_today AS (
+        SELECT COUNT(*) as count, COALESCE(SUM(amount), 0) as total
+        FROM expenses 
+        WHERE user_id = $1 AND expense_date >= CURRENT_DATE AND expense_date < CURRENT_DATE + 1
+'''
+
+VENDOR_DASHBOARD_TAIL = '''
+    ), transfer_stats AS (
+        SELECT 
+          COUNT(CASE WHEN status = 'pending' THEN 1 END) as pending,
+          COUNT(CASE WHEN status = 'in_transit' THEN 1 END) as in_transit,
+          COUNT(CASE WHEN status = 'delivered' THEN 1 END) as delivered
+        FROM transfer_requests WHERE requester_id = $1
+    ), discount_stats AS (
+        SELECT 
+          COUNT(CASE WHEN status = 'pending' THEN 1 END) as pending,
+          COUNT(CASE WHEN status = 'approved' THEN 1 END) as approved,
+          COUNT(CASE WHEN status = 'rejected' THEN 1 END) as rejected
+        FROM discount_requests WHERE seller_id = $1
+    )
+    SELECT 
+      (SELECT row_to_json(sales_today) FROM sales_today) as sales,
+      (SELECT COALESCE(json_agg(payment_methods ORDER BY total_amount DESC), '[]') FROM payment_methods) as payment_methods,
+      (SELECT row_to_json(expenses_today) FROM expenses_today) as expenses,
+      (SELECT row_to_json(transfer_stats) FROM transfer_stats) as transfers,
+      (SELECT row_to_json(discount_stats) FROM discount_stats) as discounts,
+      (SELECT COUNT(*) 
+         FROM return_notifications rn
+         JOIN transfer_requests tr ON rn.transfer_request_id = tr.id
+        WHERE tr.requester_id = $1 AND rn.read_by_requester = FALSE) as unread_returns
+'''
+
+VENDOR_DASHBOARD_SQL = VENDOR_DASHBOARD_SUMMARY_CTES + VENDOR_DASHBOARD_TAIL
+VENDOR_DASHBOARD_LIVE_SQL = VENDOR_DASHBOARD_LIVE_CTES + VENDOR_DASHBOARD_TAIL
+
+# Dashboard por usuario servido desde cache unos segundos; las escrituras del usuario lo invalidan
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "10"))
+_dashboard_cache = TTLCache(maxsize=10000, ttl=DASHBOARD_CACHE_TTL)
+_dashboard_cache_lock = threading.Lock()
+
+def invalidate_dashboard_cache(user_id: int):
+    """Descartar el dashboard cacheado de un usuario tras una escritura propia"""
+    with _dashboard_cache_lock:
+        _dashboard_cache.pop(user_id, None)
+
+def _load_vendor_dashboard(current_user) -> dict:
+    """Armar el dashboard con una conexión del pool (corre en un hilo)"""
+    with db_connection() as conn:
+        return _build_vendor_dashboard(conn, current_user)
+
 # DASHBOARD COMPLETO DEL seller
 @app.get("/api/v1/vendor/dashboard")
-async def get_vendor_dashboard_complete(current_user = Depends(get_current_user)):
-    """Dashboard completo del seller con todas las funcionalidades según requerimientos"""
+async def get_vendor_dashboard_complete(fresh: bool = False, current_user = Depends(get_current_user)):
+    """Dashboard completo del seller con todas las funcionalidades según requerimientos
+    
+    - **fresh**: ignorar el cache y recalcular (ej. justo después de registrar una venta)
+    """
     
     if current_user['role'] not in ['seller', 'administrador']:
         raise HTTPException(status_code=403, detail="Acceso denegado")
     
+    user_id = current_user['id']
+    if not fresh:
+        with _dashboard_cache_lock:
+            dashboard = _dashboard_cache.get(user_id)
+        if dashboard is not None:
+            return dashboard
+    
+    dashboard = await asyncio.to_thread(_load_vendor_dashboard, current_user)
+    with _dashboard_cache_lock:
+        _dashboard_cache[user_id] = dashboard
+    return dashboard
+
+def _build_vendor_dashboard(conn, current_user) -> dict:
+    """Consultar los datos del dashboard del seller"""
     if USE_POSTGRESQL:
-        import psycopg2
-        import psycopg2.extras
-        conn = psycopg2.connect(DB_PATH)
+        # Un solo viaje a la base: cada bloque del dashboard sale de un CTE
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        if daily_summaries_ready(conn):
+            execute_prepared(cursor, "vendor_dashboard", VENDOR_DASHBOARD_SQL, (current_user['id'],))
+        else:
+            execute_prepared(cursor, "vendor_dashboard_live", VENDOR_DASHBOARD_LIVE_SQL, (current_user['id'],))
+        dashboard = cursor.fetchone()
+        cursor.close()
         
-        # Ventas del día (confirmadas y pendientes) - PostgreSQL
-        cursor.execute(
-            '''SELECT 
-                 COUNT(*) as total_sales,
-                 COALESCE(SUM(CASE WHEN confirmed = TRUE THEN total_amount ELSE 0 END), 0) as confirmed_amount,
-                 COALESCE(SUM(CASE WHEN confirmed = FALSE AND requires_confirmation = TRUE THEN total_amount ELSE 0 END), 0) as pending_amount,
-                 COUNT(CASE WHEN confirmed = FALSE AND requires_confirmation = TRUE THEN 1 END) as pending_confirmations
-               FROM sales 
-               WHERE DATE(sale_date) = CURRENT_DATE AND seller_id = %s''',
-            (current_user['id'],)
-        )
-        sales_today = dict(cursor.fetchone())
-        
-        # Métodos de pago del día - PostgreSQL
-        cursor.execute(
-            '''SELECT sp.payment_type, SUM(sp.amount) as total_amount, COUNT(*) as count
-               FROM sale_payments sp
-               JOIN sales s ON sp.sale_id = s.id
-               WHERE DATE(s.sale_date) = CURRENT_DATE AND s.seller_id = %s AND s.confirmed = TRUE
-               GROUP BY sp.payment_type
-               ORDER BY total_amount DESC''',
-            (current_user['id'],)
-        )
-        payment_methods = [dict(row) for row in cursor.fetchall()]
-        
-        # Gastos del día - PostgreSQL
-        cursor.execute(
-            '''SELECT COUNT(*) as count, COALESCE(SUM(amount), 0) as total
-               FROM expenses 
-               WHERE DATE(expense_date) = CURRENT_DATE AND user_id = %s''',
-            (current_user['id'],)
-        )
-        expenses_today = dict(cursor.fetchone())
-        
-        # Solicitudes pendientes - PostgreSQL
-        cursor.execute(
-            '''SELECT 
-                 COUNT(CASE WHEN status = 'pending' THEN 1 END) as pending,
-                 COUNT(CASE WHEN status = 'in_transit' THEN 1 END) as in_transit,
-                 COUNT(CASE WHEN status = 'delivered' THEN 1 END) as delivered
-               FROM transfer_requests WHERE requester_id = %s''',
-            (current_user['id'],)
-        )
-        transfer_stats = dict(cursor.fetchone())
-        
-        cursor.execute(
-            '''SELECT 
-                 COUNT(CASE WHEN status = 'pending' THEN 1 END) as pending,
-                 COUNT(CASE WHEN status = 'approved' THEN 1 END) as approved,
-                 COUNT(CASE WHEN status = 'rejected' THEN 1 END) as rejected
-               FROM discount_requests WHERE seller_id = %s''',
-            (current_user['id'],)
-        )
-        discount_stats = dict(cursor.fetchone())
-        
-        # Notificaciones de devolución no leídas - PostgreSQL
-        cursor.execute(
-            '''SELECT COUNT(*) as count 
-               FROM return_notifications rn
-               JOIN transfer_requests tr ON rn.transfer_request_id = tr.id
-               WHERE tr.requester_id = %s AND rn.read_by_requester = FALSE''',
-            (current_user['id'],)
-        )
-        unread_returns = cursor.fetchone()['count'] 
+        sales_today = dashboard['sales']
+        payment_methods = dashboard['payment_methods']
+        expenses_today = dashboard['expenses']
+        transfer_stats = dashboard['transfers']
+        discount_stats = dashboard['discounts']
+        unread_returns = dashboard['unread_returns']
         
     else:
         # SQLite (código original)
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        
         # Ventas del día (confirmadas y pendientes)
         cursor = conn.execute(
             '''SELECT 
@@ -1200,7 +1706,7 @@ async def get_vendor_dashboard_complete(current_user = Depends(get_current_user)
                  COALESCE(SUM(CASE WHEN confirmed = 0 AND requires_confirmation = 1 THEN total_amount ELSE 0 END), 0) as pending_amount,
                  COUNT(CASE WHEN confirmed = 0 AND requires_confirmation = 1 THEN 1 END) as pending_confirmations
                FROM sales 
-               WHERE DATE(sale_date) = DATE('now') AND seller_id = ?''',
+               WHERE sale_date >= DATE('now') AND sale_date < DATE('now', '+1 day') AND seller_id = ?''',
             (current_user['id'],)
         )
         sales_today = dict(cursor.fetchone())
@@ -1210,7 +1716,8 @@ async def get_vendor_dashboard_complete(current_user = Depends(get_current_user)
             '''SELECT sp.payment_type, SUM(sp.amount) as total_amount, COUNT(*) as count
                FROM sale_payments sp
                JOIN sales s ON sp.sale_id = s.id
-               WHERE DATE(s.sale_date) = DATE('now') AND s.seller_id = ? AND s.confirmed = 1
+               WHERE s.sale_date >= DATE('now') AND s.sale_date < DATE('now', '+1 day')
+               AND s.seller_id = ? AND s.confirmed = 1
                GROUP BY sp.payment_type
                ORDER BY total_amount DESC''',
             (current_user['id'],)
@@ -1221,7 +1728,7 @@ async def get_vendor_dashboard_complete(current_user = Depends(get_current_user)
         cursor = conn.execute(
             '''SELECT COUNT(*) as count, COALESCE(SUM(amount), 0) as total
                FROM expenses 
-               WHERE DATE(expense_date) = DATE('now') AND user_id = ?''',
+               WHERE expense_date >= DATE('now') AND expense_date < DATE('now', '+1 day') AND user_id = ?''',
             (current_user['id'],)
         )
         expenses_today = dict(cursor.fetchone())
@@ -1257,8 +1764,6 @@ async def get_vendor_dashboard_complete(current_user = Depends(get_current_user)
         )
         unread_returns = cursor.fetchone()['count'] 
     
-    conn.close()
-    
     return {
         "success": True,
         "dashboard_timestamp": datetime.now().isoformat(),
@@ -1309,14 +1814,9 @@ async def get_vendor_dashboard_complete(current_user = Depends(get_current_user)
     }
 
 # UBICACIONES
-@app.get("/api/v1/locations")
-async def get_locations(current_user = Depends(get_current_user)):
-    """Obtener todas las ubicaciones disponibles para transferencias"""
-    
+def _query_locations(conn, current_location_id: int) -> list:
+    """Ubicaciones activas, primero la actual"""
     if USE_POSTGRESQL:
-        import psycopg2
-        import psycopg2.extras
-        conn = psycopg2.connect(DB_PATH)
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
         cursor.execute(
@@ -1328,13 +1828,11 @@ async def get_locations(current_user = Depends(get_current_user)):
                FROM locations 
                WHERE is_active = TRUE
                ORDER BY is_current_location DESC, name''',
-            (current_user['location_id'],)
+            (current_location_id,)
         )
         locations = [dict(row) for row in cursor.fetchall()]
+        cursor.close()
     else:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        
         cursor = conn.execute(
             '''SELECT *, 
                CASE 
@@ -1344,11 +1842,17 @@ async def get_locations(current_user = Depends(get_current_user)):
                FROM locations 
                WHERE is_active = 1
                ORDER BY is_current_location DESC, name''',
-            (current_user['location_id'],)
+            (current_location_id,)
         )
         locations = [dict(row) for row in cursor.fetchall()]
     
-    conn.close()
+    return locations
+
+@app.get("/api/v1/locations")
+async def get_locations(current_user = Depends(get_current_user)):
+    """Obtener todas las ubicaciones disponibles para transferencias"""
+    
+    locations = await asyncio.to_thread(run_with_connection, _query_locations, current_user['location_id'])
     
     return {
         "success": True,
@@ -1358,8 +1862,125 @@ async def get_locations(current_user = Depends(get_current_user)):
     }
 
 # VENTAS COMPLETAS CON MÉTODOS DE PAGO
+def _save_sale(current_user, total_amount: float, receipt_url: Optional[str], notes: str,
+               requires_confirmation: bool, items_data: list, payment_methods_data: list):
+    """Registrar venta, pagos, items y stock en una transacción (bloqueante: llamar desde un hilo)"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            sale_timestamp = datetime.now().isoformat()
+            print(f"🕐 [TIMESTAMP] {sale_timestamp}")
+            
+            # Crear la venta principal
+            if USE_POSTGRESQL:
+                cursor.execute(
+                    '''INSERT INTO sales (seller_id, location_id, total_amount, receipt_image, notes, 
+                                        requires_confirmation, confirmed, confirmed_at, sale_date)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id''',
+                    (current_user['id'], current_user['location_id'], total_amount, 
+                     receipt_url, notes, requires_confirmation,
+                     not requires_confirmation,  # Si no requiere confirmación, ya está confirmada
+                     None if requires_confirmation else sale_timestamp,
+                     sale_timestamp)
+                )
+                sale_id = cursor.fetchone()[0]
+            else:
+                cursor = conn.execute(
+                    '''INSERT INTO sales (seller_id, location_id, total_amount, receipt_image, notes, 
+                                        requires_confirmation, confirmed, confirmed_at, sale_date)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    (current_user['id'], current_user['location_id'], total_amount, 
+                     receipt_url, notes, requires_confirmation,
+                     not requires_confirmation,
+                     None if requires_confirmation else sale_timestamp,
+                     sale_timestamp)
+                )
+                sale_id = cursor.lastrowid
+            
+            print(f"✅ [DATABASE] Venta creada con ID: {sale_id}")
+            
+            # Métodos de pago e items: un INSERT por tabla en lugar de uno por fila
+            payment_rows = [
+                (sale_id, payment['type'], payment['amount'], payment.get('reference'))
+                for payment in payment_methods_data
+            ]
+            item_rows = [
+                (sale_id, item['sneaker_reference_code'], item['brand'], item['model'], 
+                 item.get('color'), item['size'], item['quantity'], item['unit_price'],
+                 float(item['quantity']) * float(item['unit_price']))
+                for item in items_data
+            ]
+            total_items_value = sum(row[-1] for row in item_rows)
+            
+            if USE_POSTGRESQL:
+                psycopg2.extras.execute_values(
+                    cursor,
+                    'INSERT INTO sale_payments (sale_id, payment_type, amount, reference) VALUES %s',
+                    payment_rows, page_size=100
+                )
+                psycopg2.extras.execute_values(
+                    cursor,
+                    '''INSERT INTO sale_items (sale_id, sneaker_reference_code, brand, model, color, 
+                                             size, quantity, unit_price, subtotal) VALUES %s''',
+                    item_rows, page_size=100
+                )
+            else:
+                conn.executemany(
+                    '''INSERT INTO sale_payments (sale_id, payment_type, amount, reference)
+                       VALUES (?, ?, ?, ?)''',
+                    payment_rows
+                )
+                conn.executemany(
+                    '''INSERT INTO sale_items (sale_id, sneaker_reference_code, brand, model, color, 
+                                             size, quantity, unit_price, subtotal)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    item_rows
+                )
+            
+            print(f"✅ [DATABASE] {len(payment_rows)} métodos de pago y {len(item_rows)} items registrados")
+            print(f"✅ [DATABASE] Total items calculado: ${total_items_value}")
+            
+            # Descontar stock en la misma transacción si no requiere confirmación
+            if not requires_confirmation:
+                print(f"📦 [STOCK] Actualizando stock...")
+                # Savepoint: un error de stock no debe tumbar la venta
+                cursor.execute("SAVEPOINT stock_update")
+                try:
+                    stock_issues = checkout_stock(
+                        conn, items_data, current_user['location_id'], validate=VALIDATE_STOCK_ON_SALE
+                    )
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT stock_update")
+                    print(f"⚠️ [STOCK] Error actualizando stock: {e}")
+                else:
+                    if VALIDATE_STOCK_ON_SALE and stock_issues:
+                        print(f"❌ [STOCK] Issues encontrados: {stock_issues}")
+                        raise HTTPException(
+                            status_code=400, 
+                            detail=f"Stock insuficiente: {stock_issues}"
+                        )
+                    print(f"✅ [STOCK] Stock actualizado correctamente")
+            else:
+                print(f"⏳ [STOCK] Actualización de stock pendiente de confirmación")
+            
+            # Commit de la transacción (venta + pagos + items + stock)
+            conn.commit()
+            print(f"✅ [DATABASE] Transacción completada exitosamente")
+            return sale_id, sale_timestamp, total_items_value
+        
+        except HTTPException:
+            conn.rollback()
+            raise
+        except Exception as e:
+            # Rollback en caso de error
+            conn.rollback()
+            print(f"❌ [DATABASE] Error en transacción: {e}")
+            print(f"❌ [DATABASE] Rollback ejecutado")
+            raise HTTPException(status_code=500, detail=f"Error registrando venta: {str(e)}")
+
 @app.post("/api/v1/sales/create")
 async def create_sale_complete(
+    background_tasks: BackgroundTasks,
     # Datos como Form fields - TODOS los parámetros con Form(...)
     items: str = Form(..., description="JSON string con array de items de la venta"),
     total_amount: float = Form(..., description="Monto total de la venta", gt=0),
@@ -1428,63 +2049,15 @@ async def create_sale_complete(
     if total_amount <= 0:
         raise HTTPException(status_code=400, detail="El monto total debe ser mayor a 0")
     
-    try:
-        # Parsear datos JSON
-        print(f"📦 [JSON] Parseando items: {items[:200]}..." if len(items) > 200 else f"📦 [JSON] Items: {items}")
-        items_data = json.loads(items)
-        
-        print(f"💳 [JSON] Parseando payment methods: {payment_methods[:200]}..." if len(payment_methods) > 200 else f"💳 [JSON] Payment methods: {payment_methods}")
-        payment_methods_data = json.loads(payment_methods)
-        
-        print(f"✅ [JSON] Parseado exitoso:")
-        print(f"   Items: {len(items_data)} productos")
-        print(f"   Métodos de pago: {len(payment_methods_data)} métodos")
-        
-    except json.JSONDecodeError as e:
-        print(f"❌ [JSON] Error parseando JSON: {e}")
-        raise HTTPException(status_code=400, detail=f"Datos JSON inválidos: {str(e)}")
-    except Exception as e:
-        print(f"❌ [JSON] Error inesperado parseando: {e}")
-        raise HTTPException(status_code=400, detail=f"Error procesando datos: {str(e)}")
-    
-    # Validar estructura de items
-    try:
-        for i, item in enumerate(items_data):
-            required_fields = ['sneaker_reference_code', 'brand', 'model', 'size', 'quantity', 'unit_price']
-            for field in required_fields:
-                if field not in item:
-                    raise HTTPException(status_code=400, detail=f"Item {i+1}: falta campo '{field}'")
-            
-            if item['quantity'] <= 0:
-                raise HTTPException(status_code=400, detail=f"Item {i+1}: quantity debe ser mayor a 0")
-            
-            if item['unit_price'] <= 0:
-                raise HTTPException(status_code=400, detail=f"Item {i+1}: unit_price debe ser mayor a 0")
-        
-        print(f"✅ [VALIDATION] Items validados correctamente")
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error validando items: {str(e)}")
+    # Parsear y validar en una sola pasada de pydantic-core (campos, tipos, quantity/amount > 0)
+    print(f"📦 [JSON] Parseando items: {items[:200]}..." if len(items) > 200 else f"📦 [JSON] Items: {items}")
+    print(f"💳 [JSON] Parseando payment methods: {payment_methods[:200]}..." if len(payment_methods) > 200 else f"💳 [JSON] Payment methods: {payment_methods}")
+    items_data = parse_form_json(SALE_ITEMS_ADAPTER, items, "items")
+    payment_methods_data = parse_form_json(PAYMENT_METHODS_ADAPTER, payment_methods, "payment_methods")
     
-    # Validar estructura de métodos de pago
-    try:
-        for i, payment in enumerate(payment_methods_data):
-            required_fields = ['type', 'amount']
-            for field in required_fields:
-                if field not in payment:
-                    raise HTTPException(status_code=400, detail=f"Método de pago {i+1}: falta campo '{field}'")
-            
-            if payment['amount'] <= 0:
-                raise HTTPException(status_code=400, detail=f"Método de pago {i+1}: amount debe ser mayor a 0")
-        
-        print(f"✅ [VALIDATION] Métodos de pago validados correctamente")
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error validando métodos de pago: {str(e)}")
+    print(f"✅ [VALIDATION] Items y métodos de pago validados correctamente")
+    print(f"   Items: {len(items_data)} productos")
+    print(f"   Métodos de pago: {len(payment_methods_data)} métodos")
     
     # Validar que los métodos de pago sumen el total
     total_payments = sum(float(payment['amount']) for payment in payment_methods_data)
@@ -1492,33 +2065,16 @@ async def create_sale_complete(
         print(f"❌ [VALIDATION] Métodos de pago no coinciden:")
         print(f"   Total esperado: ${total_amount}")
         print(f"   Total métodos de pago: ${total_payments}")
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Los métodos de pago (${total_payments:.2f}) no coinciden con el total (${total_amount:.2f})"
-        )
-    
-    print(f"✅ [VALIDATION] Totales coinciden: ${total_amount}")
-    
-    # Validar stock disponible (opcional, descomenta si quieres validar stock)
-    """
-    try:
-        stock_issues = validate_stock_availability(items_data, current_user['location_id'])
-        if stock_issues:
-            print(f"❌ [STOCK] Issues encontrados: {stock_issues}")
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Stock insuficiente: {stock_issues}"
-            )
-        print(f"✅ [STOCK] Stock disponible para todos los items")
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"⚠️ [STOCK] Error validando stock: {e}")
-        # Continuar sin validación de stock si hay error
-    """
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Los métodos de pago (${total_payments:.2f}) no coinciden con el total (${total_amount:.2f})"
+        )
+    
+    print(f"✅ [VALIDATION] Totales coinciden: ${total_amount}")
     
     # Subir imagen a Cloudinary si existe
     receipt_url = None
+    pending_receipt = None
     if receipt_image and receipt_image.filename:
         try:
             print(f"📸 [CLOUDINARY] Subiendo comprobante de venta...")
@@ -1533,196 +2089,90 @@ async def create_sale_complete(
             print(f"✅ [CLOUDINARY] Comprobante subido exitosamente:")
             print(f"   URL: {receipt_url}")
             
+        except ReceiptUploadUnavailable:
+            # Cloudinary lento o caído: la venta se guarda sin comprobante y se completa después
+            await receipt_image.seek(0)
+            pending_receipt = await read_upload_limited(receipt_image)
+            print(f"⏳ [CLOUDINARY] Comprobante en cola para subir en segundo plano")
         except Exception as e:
             print(f"❌ [CLOUDINARY] Error subiendo imagen: {e}")
             # Continuar sin imagen si falla el upload - la venta no debe fallar por esto
             receipt_url = None
     
-    # Conectar a base de datos
-    if USE_POSTGRESQL:
-        import psycopg2
-        conn = psycopg2.connect(DB_PATH)
-        cursor = conn.cursor()
-        print(f"🔗 [DATABASE] Conectado a PostgreSQL")
-    else:
-        conn = sqlite3.connect(DB_PATH)
-        print(f"🔗 [DATABASE] Conectado a SQLite")
+    # La conexión se toma recién ahora, solo para la transacción (no durante la subida)
+    sale_id, sale_timestamp, total_items_value = await asyncio.to_thread(
+        _save_sale, current_user, total_amount, receipt_url, notes,
+        requires_confirmation, items_data, payment_methods_data
+    )
+    invalidate_dashboard_cache(current_user['id'])
     
-    try:
-        sale_timestamp = datetime.now().isoformat()
-        print(f"🕐 [TIMESTAMP] {sale_timestamp}")
-        
-        # Crear la venta principal
-        if USE_POSTGRESQL:
-            cursor.execute(
-                '''INSERT INTO sales (seller_id, location_id, total_amount, receipt_image, notes, 
-                                    requires_confirmation, confirmed, confirmed_at, sale_date)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id''',
-                (current_user['id'], current_user['location_id'], total_amount, 
-                 receipt_url, notes, requires_confirmation,
-                 not requires_confirmation,  # Si no requiere confirmación, ya está confirmada
-                 None if requires_confirmation else sale_timestamp,
-                 sale_timestamp)
-            )
-            sale_id = cursor.fetchone()[0]
-        else:
-            cursor = conn.execute(
-                '''INSERT INTO sales (seller_id, location_id, total_amount, receipt_image, notes, 
-                                    requires_confirmation, confirmed, confirmed_at, sale_date)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                (current_user['id'], current_user['location_id'], total_amount, 
-                 receipt_url, notes, requires_confirmation,
-                 not requires_confirmation,
-                 None if requires_confirmation else sale_timestamp,
-                 sale_timestamp)
-            )
-            sale_id = cursor.lastrowid
-        
-        print(f"✅ [DATABASE] Venta creada con ID: {sale_id}")
-        
-        # Crear los métodos de pago
-        for i, payment in enumerate(payment_methods_data):
-            if USE_POSTGRESQL:
-                cursor.execute(
-                    '''INSERT INTO sale_payments (sale_id, payment_type, amount, reference)
-                       VALUES (%s, %s, %s, %s)''',
-                    (sale_id, payment['type'], payment['amount'], payment.get('reference'))
-                )
-            else:
-                conn.execute(
-                    '''INSERT INTO sale_payments (sale_id, payment_type, amount, reference)
-                       VALUES (?, ?, ?, ?)''',
-                    (sale_id, payment['type'], payment['amount'], payment.get('reference'))
-                )
-            
-            print(f"✅ [DATABASE] Método de pago {i+1}: {payment['type']} ${payment['amount']}")
-        
-        # Crear los items de la venta
-        total_items_value = 0
-        for i, item in enumerate(items_data):
-            subtotal = float(item['quantity']) * float(item['unit_price'])
-            total_items_value += subtotal
-            
-            if USE_POSTGRESQL:
-                cursor.execute(
-                    '''INSERT INTO sale_items (sale_id, sneaker_reference_code, brand, model, color, 
-                                             size, quantity, unit_price, subtotal)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-                    (sale_id, item['sneaker_reference_code'], item['brand'], item['model'], 
-                     item.get('color'), item['size'], item['quantity'], item['unit_price'], subtotal)
-                )
-            else:
-                conn.execute(
-                    '''INSERT INTO sale_items (sale_id, sneaker_reference_code, brand, model, color, 
-                                             size, quantity, unit_price, subtotal)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                    (sale_id, item['sneaker_reference_code'], item['brand'], item['model'], 
-                     item.get('color'), item['size'], item['quantity'], item['unit_price'], subtotal)
-                )
-            
-            print(f"✅ [DATABASE] Item {i+1}: {item['brand']} {item['model']} - {item['quantity']}x${item['unit_price']} = ${subtotal}")
-        
-        print(f"✅ [DATABASE] Total items calculado: ${total_items_value}")
-        
-        # Commit de la transacción
-        conn.commit()
-        print(f"✅ [DATABASE] Transacción completada exitosamente")
-        
-        # Actualizar stock si no requiere confirmación
-        if not requires_confirmation:
-            try:
-                print(f"📦 [STOCK] Actualizando stock...")
-                update_stock_after_sale(items_data, current_user['location_id'])
-                print(f"✅ [STOCK] Stock actualizado correctamente")
-            except Exception as e:
-                print(f"⚠️ [STOCK] Error actualizando stock: {e}")
-                # No fallar la venta por error de stock
-        else:
-            print(f"⏳ [STOCK] Actualización de stock pendiente de confirmación")
-        
-        # Preparar respuesta
-        response_data = {
-            "success": True,
-            "sale_id": sale_id,
-            "message": "Venta registrada exitosamente",
-            "sale_timestamp": sale_timestamp,
-            "sale_details": {
-                "total_amount": total_amount,
-                "items_count": len(items_data),
-                "payment_methods_count": len(payment_methods_data),
-                "total_items_value": total_items_value
-            },
-            "payment_breakdown": [
-                {
-                    "type": p['type'], 
-                    "amount": p['amount'], 
-                    "reference": p.get('reference')
-                } for p in payment_methods_data
-            ],
-            "items_summary": [
-                {
-                    "reference": item['sneaker_reference_code'],
-                    "brand": item['brand'],
-                    "model": item['model'],
-                    "size": item['size'],
-                    "quantity": item['quantity'],
-                    "unit_price": item['unit_price'],
-                    "subtotal": item['quantity'] * item['unit_price']
-                } for item in items_data
-            ],
-            "receipt_info": {
-                "has_receipt": bool(receipt_url),
-                "receipt_url": receipt_url,
-                "stored_in": "Cloudinary CDN" if receipt_url else None
-            },
-            "status_info": {
-                "status": "pending_confirmation" if requires_confirmation else "confirmed",
-                "requires_confirmation": requires_confirmation,
-                "confirmed": not requires_confirmation,
-                "confirmed_at": None if requires_confirmation else sale_timestamp
-            },
-            "seller_info": {
-                "seller_id": current_user['id'],
-                "seller_name": f"{current_user['first_name']} {current_user['last_name']}",
-                "seller_email": current_user['email'],
-                "location_id": current_user['location_id']
-            }
+    if pending_receipt is not None:
+        background_tasks.add_task(
+            backfill_sale_receipt, sale_id, current_user['id'], pending_receipt,
+            receipt_image.filename, receipt_image.content_type
+        )
+    
+    # Preparar respuesta
+    response_data = {
+        "success": True,
+        "sale_id": sale_id,
+        "message": "Venta registrada exitosamente",
+        "sale_timestamp": sale_timestamp,
+        "sale_details": {
+            "total_amount": total_amount,
+            "items_count": len(items_data),
+            "payment_methods_count": len(payment_methods_data),
+            "total_items_value": total_items_value
+        },
+        "payment_breakdown": [
+            {
+                "type": p['type'], 
+                "amount": p['amount'], 
+                "reference": p.get('reference')
+            } for p in payment_methods_data
+        ],
+        "items_summary": [
+            {
+                "reference": item['sneaker_reference_code'],
+                "brand": item['brand'],
+                "model": item['model'],
+                "size": item['size'],
+                "quantity": item['quantity'],
+                "unit_price": item['unit_price'],
+                "subtotal": item['quantity'] * item['unit_price']
+            } for item in items_data
+        ],
+        "receipt_info": {
+            "has_receipt": bool(receipt_url),
+            "receipt_url": receipt_url,
+            "stored_in": "Cloudinary CDN" if receipt_url else None,
+            "upload_pending": pending_receipt is not None
+        },
+        "status_info": {
+            "status": "pending_confirmation" if requires_confirmation else "confirmed",
+            "requires_confirmation": requires_confirmation,
+            "confirmed": not requires_confirmation,
+            "confirmed_at": None if requires_confirmation else sale_timestamp
+        },
+        "seller_info": {
+            "seller_id": current_user['id'],
+            "seller_name": f"{current_user['first_name']} {current_user['last_name']}",
+            "seller_email": current_user['email'],
+            "location_id": current_user['location_id']
         }
-        
-        print(f"🎉 [SUCCESS] Venta {sale_id} registrada exitosamente")
-        print(f"   Total: ${total_amount}")
-        print(f"   Items: {len(items_data)}")
-        print(f"   Métodos de pago: {len(payment_methods_data)}")
-        print(f"   Estado: {'Pendiente confirmación' if requires_confirmation else 'Confirmada'}")
-        
-        return response_data
-        
-    except Exception as e:
-        # Rollback en caso de error
-        conn.rollback()
-        print(f"❌ [DATABASE] Error en transacción: {e}")
-        print(f"❌ [DATABASE] Rollback ejecutado")
-        raise HTTPException(status_code=500, detail=f"Error registrando venta: {str(e)}")
-        
-    finally:
-        # Cerrar conexión
-        conn.close()
-        print(f"🔐 [DATABASE] Conexión cerrada")
-
-@app.post("/api/v1/sales/confirm")
-async def confirm_sale(
-    confirmation: SaleConfirmation,
-    current_user = Depends(get_current_user)
-):
-    """Confirmar una venta pendiente - Confirmación de la venta según requerimientos"""
+    }
     
-    if current_user['role'] not in ['seller', 'administrador']:
-        raise HTTPException(status_code=403, detail="Solo selleres pueden confirmar ventas")
+    print(f"🎉 [SUCCESS] Venta {sale_id} registrada exitosamente")
+    print(f"   Total: ${total_amount}")
+    print(f"   Items: {len(items_data)}")
+    print(f"   Métodos de pago: {len(payment_methods_data)}")
+    print(f"   Estado: {'Pendiente confirmación' if requires_confirmation else 'Confirmada'}")
     
+    return response_data
+
+def _confirm_sale(conn, confirmation: SaleConfirmation, current_user) -> str:
+    """Marcar la venta como (no) confirmada y descontar stock en la misma transacción"""
     if USE_POSTGRESQL:
-        import psycopg2
-        import psycopg2.extras
-        conn = psycopg2.connect(DB_PATH)
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
         # Verificar que la venta existe y pertenece al seller
@@ -1732,7 +2182,6 @@ async def confirm_sale(
         )
         sale = cursor.fetchone()
     else:
-        conn = sqlite3.connect(DB_PATH)
         cursor = conn.execute(
             'SELECT * FROM sales WHERE id = ? AND seller_id = ? AND requires_confirmation = 1',
             (confirmation.sale_id, current_user['id'])
@@ -1740,7 +2189,6 @@ async def confirm_sale(
         sale = cursor.fetchone()
     
     if not sale:
-        conn.close()
         raise HTTPException(status_code=404, detail="Venta no encontrada o ya confirmada")
     
     # Actualizar confirmación de la venta
@@ -1767,16 +2215,33 @@ async def confirm_sale(
              confirmation.sale_id)
         )
     
-    conn.commit()
-    conn.close()
+    try:
+        if confirmation.confirmed:
+            # Descontar stock en la misma transacción que la confirmación
+            sale_items = get_sale_items(conn, confirmation.sale_id)
+            checkout_stock(conn, sale_items, current_user['location_id'], validate=False)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        logger.exception("Error confirmando la venta %s", confirmation.sale_id)
+        raise HTTPException(status_code=500, detail="Error actualizando stock")
+    
+    return confirmation_timestamp
 
-    if confirmation.confirmed:
-        # Obtener items de la venta
-        sale_items = get_sale_items(confirmation.sale_id)
-        try:
-            update_stock_after_sale(sale_items, current_user['location_id'])
-        except Exception as e:
-            raise HTTPException(status_code=500, detail="Error actualizando stock")
+@app.post("/api/v1/sales/confirm")
+async def confirm_sale(
+    confirmation: SaleConfirmation,
+    current_user = Depends(get_current_user)
+):
+    """Confirmar una venta pendiente - Confirmación de la venta según requerimientos"""
+    
+    if current_user['role'] not in ['seller', 'administrador']:
+        raise HTTPException(status_code=403, detail="Solo selleres pueden confirmar ventas")
+    
+    confirmation_timestamp = await asyncio.to_thread(
+        run_with_connection, _confirm_sale, confirmation, current_user
+    )
+    invalidate_dashboard_cache(current_user['id'])
     
     return {
         "success": True,
@@ -1787,80 +2252,50 @@ async def confirm_sale(
         "confirmed_by": f"{current_user['first_name']} {current_user['last_name']}"
     }
 
-@app.get("/api/v1/sales/today")
-async def get_today_sales(current_user = Depends(get_current_user)):
-    """Visualizar todas las ventas del día según requerimientos"""
-    
-    if current_user['role'] not in ['seller', 'administrador']:
-        raise HTTPException(status_code=403, detail="Acceso denegado")
-    
+TODAY_SALES_SQL = '''
+    SELECT s.*, u.first_name, u.last_name, l.name as location_name
+    FROM sales s
+    JOIN users u ON s.seller_id = u.id
+    JOIN locations l ON s.location_id = l.id
+    WHERE s.sale_date >= CURRENT_DATE AND s.sale_date < CURRENT_DATE + INTERVAL '1 day'
+    AND s.seller_id = $1
+    ORDER BY s.sale_date DESC
+'''
+
+def _query_today_sales(conn, user_id: int) -> list:
+    """Ventas del día del seller con sus items y métodos de pago"""
     if USE_POSTGRESQL:
-        import psycopg2
-        import psycopg2.extras
-        conn = psycopg2.connect(DB_PATH)
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
         # Obtener todas las ventas del día
-        cursor.execute(
-            '''SELECT s.*, u.first_name, u.last_name, l.name as location_name
-               FROM sales s
-               JOIN users u ON s.seller_id = u.id
-               JOIN locations l ON s.location_id = l.id
-               WHERE DATE(s.sale_date) = CURRENT_DATE
-               AND s.seller_id = %s
-               ORDER BY s.sale_date DESC''',
-            (current_user['id'],)
-        )
+        execute_prepared(cursor, "today_sales", TODAY_SALES_SQL, (user_id,))
         sales = [dict(row) for row in cursor.fetchall()]
-        
-        # Para cada venta, obtener items y métodos de pago
-        for sale in sales:
-            # Items de la venta
-            cursor.execute(
-                'SELECT * FROM sale_items WHERE sale_id = %s',
-                (sale['id'],)
-            )
-            sale['items'] = [dict(row) for row in cursor.fetchall()]
-            
-            # Métodos de pago
-            cursor.execute(
-                'SELECT * FROM sale_payments WHERE sale_id = %s',
-                (sale['id'],)
-            )
-            sale['payment_methods'] = [dict(row) for row in cursor.fetchall()]
-            
+        cursor.close()
     else:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        
         # Obtener todas las ventas del día
         cursor = conn.execute(
             '''SELECT s.*, u.first_name, u.last_name, l.name as location_name
                FROM sales s
                JOIN users u ON s.seller_id = u.id
                JOIN locations l ON s.location_id = l.id
-               WHERE DATE(s.sale_date) = DATE('now', 'localtime')
+               WHERE s.sale_date >= DATE('now', 'localtime') AND s.sale_date < DATE('now', 'localtime', '+1 day')
                AND s.seller_id = ?
                ORDER BY s.sale_date DESC''',
-            (current_user['id'],)
+            (user_id,)
         )
         sales = [dict(row) for row in cursor.fetchall()]
-        
-        # Para cada venta, obtener items y métodos de pago
-        for sale in sales:
-            # Items de la venta
-            cursor = conn.execute(
-                'SELECT * FROM sale_items WHERE sale_id = ?',
-                (sale['id'],)
-            )
-            sale['items'] = [dict(row) for row in cursor.fetchall()]
-            
-            # Métodos de pago
-            cursor = conn.execute(
-                'SELECT * FROM sale_payments WHERE sale_id = ?',
-                (sale['id'],)
-            )
-            sale['payment_methods'] = [dict(row) for row in cursor.fetchall()]
+    
+    # Items y métodos de pago de todas las ventas en una consulta por tabla
+    return attach_sale_details(conn, sales)
+
+@app.get("/api/v1/sales/today")
+async def get_today_sales(current_user = Depends(get_current_user)):
+    """Visualizar todas las ventas del día según requerimientos"""
+    
+    if current_user['role'] not in ['seller', 'administrador']:
+        raise HTTPException(status_code=403, detail="Acceso denegado")
+    
+    sales = await asyncio.to_thread(run_with_connection, _query_today_sales, current_user['id'])
     
     # Agregar información de estado para todas las ventas
     for sale in sales:
@@ -1886,8 +2321,6 @@ async def get_today_sales(current_user = Depends(get_current_user)):
                 payment_stats[payment['payment_type']]["count"] += 1
                 payment_stats[payment['payment_type']]["amount"] += payment['amount']
     
-    conn.close()
-    
     return {
         "success": True,
         "date": datetime.now().date().isoformat(),
@@ -1904,40 +2337,24 @@ async def get_today_sales(current_user = Depends(get_current_user)):
         }
     }
 
-@app.get("/api/v1/sales/pending-confirmation")
-async def get_pending_confirmation_sales(current_user = Depends(get_current_user)):
-    """Obtener ventas pendientes de confirmación"""
-    if current_user['role'] not in ['seller', 'administrador']:
-        raise HTTPException(status_code=403, detail="Acceso denegado")
-    
+PENDING_CONFIRMATION_SALES_SQL = '''
+    SELECT s.*, u.first_name, u.last_name, l.name as location_name
+    FROM sales s
+    JOIN users u ON s.seller_id = u.id
+    JOIN locations l ON s.location_id = l.id
+    WHERE s.seller_id = $1 AND s.requires_confirmation = TRUE AND s.confirmed = FALSE
+    ORDER BY s.sale_date DESC
+'''
+
+def _query_pending_confirmation_sales(conn, user_id: int) -> list:
+    """Ventas del seller pendientes de confirmación con sus items y métodos de pago"""
     if USE_POSTGRESQL:
-        import psycopg2
-        import psycopg2.extras
-        conn = psycopg2.connect(DB_PATH)
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
-        cursor.execute(
-            '''SELECT s.*, u.first_name, u.last_name, l.name as location_name
-                FROM sales s
-                JOIN users u ON s.seller_id = u.id
-                JOIN locations l ON s.location_id = l.id
-                WHERE s.seller_id = %s AND s.requires_confirmation = TRUE AND s.confirmed = FALSE
-                ORDER BY s.sale_date DESC''',
-            (current_user['id'],)
-        )
+        execute_prepared(cursor, "pending_confirmation_sales", PENDING_CONFIRMATION_SALES_SQL, (user_id,))
         sales = [dict(row) for row in cursor.fetchall()]
-        
-        # Para cada venta, obtener items y métodos de pago
-        for sale in sales:
-            cursor.execute('SELECT * FROM sale_items WHERE sale_id = %s', (sale['id'],))
-            sale['items'] = [dict(row) for row in cursor.fetchall()]
-            
-            cursor.execute('SELECT * FROM sale_payments WHERE sale_id = %s', (sale['id'],))
-            sale['payment_methods'] = [dict(row) for row in cursor.fetchall()]
+        cursor.close()
     else:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        
         cursor = conn.execute(
             '''SELECT s.*, u.first_name, u.last_name, l.name as location_name
                 FROM sales s
@@ -1945,19 +2362,20 @@ async def get_pending_confirmation_sales(current_user = Depends(get_current_user
                 JOIN locations l ON s.location_id = l.id
                 WHERE s.seller_id = ? AND s.requires_confirmation = 1 AND s.confirmed = 0
                 ORDER BY s.sale_date DESC''',
-            (current_user['id'],)
+            (user_id,)
         )
         sales = [dict(row) for row in cursor.fetchall()]
-        
-        # Para cada venta, obtener items y métodos de pago
-        for sale in sales:
-            cursor = conn.execute('SELECT * FROM sale_items WHERE sale_id = ?', (sale['id'],))
-            sale['items'] = [dict(row) for row in cursor.fetchall()]
-            
-            cursor = conn.execute('SELECT * FROM sale_payments WHERE sale_id = ?', (sale['id'],))
-            sale['payment_methods'] = [dict(row) for row in cursor.fetchall()]
     
-    conn.close()
+    # Items y métodos de pago de todas las ventas en una consulta por tabla
+    return attach_sale_details(conn, sales)
+
+@app.get("/api/v1/sales/pending-confirmation")
+async def get_pending_confirmation_sales(current_user = Depends(get_current_user)):
+    """Obtener ventas pendientes de confirmación"""
+    if current_user['role'] not in ['seller', 'administrador']:
+        raise HTTPException(status_code=403, detail="Acceso denegado")
+    
+    sales = await asyncio.to_thread(run_with_connection, _query_pending_confirmation_sales, current_user['id'])
     
     return {
         "success": True,
@@ -2044,6 +2462,7 @@ async def create_expense_corrected(
             expense_id = cursor.lastrowid
         
         conn.commit()
+        invalidate_dashboard_cache(current_user['id'])
         print(f"✅ [DATABASE] Gasto registrado: ID {expense_id}")
         
         return {
@@ -2087,7 +2506,7 @@ async def get_today_expenses(current_user = Depends(get_current_user)):
                FROM expenses e
                JOIN users u ON e.user_id = u.id
                JOIN locations l ON e.location_id = l.id
-               WHERE DATE(e.expense_date) = CURRENT_DATE 
+               WHERE e.expense_date >= CURRENT_DATE AND e.expense_date < CURRENT_DATE + INTERVAL '1 day'
                AND e.user_id = %s
                ORDER BY e.expense_date DESC''',
             (current_user['id'],)
@@ -2102,7 +2521,7 @@ async def get_today_expenses(current_user = Depends(get_current_user)):
                FROM expenses e
                JOIN users u ON e.user_id = u.id
                JOIN locations l ON e.location_id = l.id
-               WHERE DATE(e.expense_date) = DATE('now', 'localtime') 
+               WHERE e.expense_date >= DATE('now', 'localtime') AND e.expense_date < DATE('now', 'localtime', '+1 day')
                AND e.user_id = ?
                ORDER BY e.expense_date DESC''',
             (current_user['id'],)
@@ -2168,10 +2587,6 @@ async def create_transfer_request_complete(
              transfer_data.pickup_type, transfer_data.destination_type, transfer_data.notes, request_timestamp)
         )
         request_id = cursor.fetchone()[0]
-        
-        # Obtener nombre de la ubicación origen
-        cursor.execute('SELECT name FROM locations WHERE id = %s', (transfer_data.source_location_id,))
-        source_location = cursor.fetchone()
     else:
         cursor = conn.execute(
             '''INSERT INTO transfer_requests 
@@ -2184,13 +2599,13 @@ async def create_transfer_request_complete(
              transfer_data.pickup_type, transfer_data.destination_type, transfer_data.notes, request_timestamp)
         )
         request_id = cursor.lastrowid
-        
-        # Obtener nombre de la ubicación origen
-        cursor = conn.execute('SELECT name FROM locations WHERE id = ?', (transfer_data.source_location_id,))
-        source_location = cursor.fetchone()
+    
+    # Obtener nombre de la ubicación origen
+    source_location_name = get_location_name(conn, transfer_data.source_location_id)
     
     conn.commit()
     conn.close()
+    invalidate_dashboard_cache(current_user['id'])
     
     return {
         "success": True,
@@ -2205,7 +2620,7 @@ async def create_transfer_request_complete(
                 "size": transfer_data.size,
                 "quantity": transfer_data.quantity
             },
-            "source_location": source_location[0] if source_location else f"Local #{transfer_data.source_location_id}",
+            "source_location": source_location_name or f"Local #{transfer_data.source_location_id}",
             "destination_location": f"Local #{current_user['location_id']}",
             "purpose": "Para exhibición" if transfer_data.purpose == "exhibition" else "Para venta",
             "pickup_arrangement": {
@@ -2353,6 +2768,7 @@ async def create_discount_request(
     
     conn.commit()
     conn.close()
+    invalidate_dashboard_cache(current_user['id'])
     
     return {
         "success": True,
@@ -2517,6 +2933,7 @@ async def create_return_request(
     
     conn.commit()
     conn.close()
+    invalidate_dashboard_cache(current_user['id'])
     
     return {
         "success": True,
@@ -2654,6 +3071,7 @@ async def mark_return_notification_read(
     
     conn.commit()
     conn.close()
+    invalidate_dashboard_cache(current_user['id'])
     
     return {
         "success": True,
@@ -2763,6 +3181,7 @@ async def cloudinary_status():
                 "storage_used_mb": round(usage_info.get("storage", {}).get("used", 0) / 1024 / 1024, 2) if usage_info else "unavailable",
                 "transformations_used": usage_info.get("transformations", {}).get("used", 0) if usage_info else "unavailable"
             } if usage_info else "unavailable",
+            "circuit_breaker": cloudinary_breaker.snapshot(),
             "features": [
                 "Upload directo en endpoints de venta/gasto",
                 "Optimización automática de imágenes", 
@@ -2786,6 +3205,7 @@ async def cloudinary_status():
             "configured": True,
             "connection": "error",
             "error": str(e),
+            "circuit_breaker": cloudinary_breaker.snapshot(),
             "cloudinary_config": {
                 "cloud_name": os.getenv("CLOUDINARY_CLOUD_NAME", "not_set"),
                 "api_key_set": bool(os.getenv("CLOUDINARY_API_KEY")),
@@ -3026,6 +3446,11 @@ def init_database_if_needed():
             else:
                 print("✅ Tablas PostgreSQL ya existen")
             
+            # Índices siempre (IF NOT EXISTS): también aplica a BD ya existentes
+            create_postgresql_indexes(conn)
+            create_daily_summaries(conn)
+            create_inventory_indexes(conn)
+            
             conn.close()
             
         elif DATABASE_URL.startswith("sqlite"):
@@ -3221,19 +3646,17 @@ def create_postgresql_tables(conn):
         ("Bodega Norte", "bodega", "Zona Industrial Norte 202")
     ]
     
+    psycopg2.extras.execute_values(
+        cursor,
+        'INSERT INTO locations (name, type, address) VALUES %s ON CONFLICT DO NOTHING',
+        locations_to_create
+    )
     for location_data in locations_to_create:
-        cursor.execute(
-            'INSERT INTO locations (name, type, address) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING',
-            location_data
-        )
         print(f"✅ Ubicación creada: {location_data[0]} ({location_data[1]})")
     
     # Crear usuario admin por defecto
     # Crear usuarios por defecto de diferentes roles
     try:
-        from passlib.context import CryptContext
-        pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
-        
         cursor.execute("SELECT id FROM locations WHERE name = %s", ("Local Principal",))
         location_result = cursor.fetchone()
         if location_result:
@@ -3278,19 +3701,297 @@ def create_postgresql_tables(conn):
                 }
             ]
             
+            # bcrypt es CPU puro: calcular los hashes en paralelo
+            with ProcessPoolExecutor() as executor:
+                password_hashes = list(executor.map(
+                    get_password_hash, [user_data["password"] for user_data in users_to_create]
+                ))
+            
+            user_rows = [
+                (user_data["email"], password_hash, user_data["first_name"],
+                 user_data["last_name"], user_data["role"], location_id)
+                for user_data, password_hash in zip(users_to_create, password_hashes)
+            ]
+            psycopg2.extras.execute_values(
+                cursor,
+                '''INSERT INTO users (email, password_hash, first_name, last_name, role, location_id)
+                   VALUES %s ON CONFLICT (email) DO NOTHING''',
+                user_rows
+            )
             for user_data in users_to_create:
-                password_hash = pwd_ctx.hash(user_data["password"])
-                
-                cursor.execute(
-                    '''INSERT INTO users (email, password_hash, first_name, last_name, role, location_id)
-                       VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (email) DO NOTHING''',
-                    (user_data["email"], password_hash, user_data["first_name"], 
-                     user_data["last_name"], user_data["role"], location_id)
-                )
                 print(f"✅ Usuario {user_data['role']}: {user_data['email']} / {user_data['password']}")
                 
     except Exception as e:
         print(f"⚠️ Error creando usuarios: {e}")
+    
+    # DDL + datos iniciales se confirman juntos en una sola transacción
+    conn.commit()
+
+
+def create_postgresql_indexes(conn):
+    """Crear índices para las consultas frecuentes (login y reportes de ventas)"""
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_email_active
+        ON users (email, is_active) INCLUDE (id, password_hash, first_name, last_name, role, location_id)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_active_id ON users (is_active, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sales_seller_date ON sales (seller_id, sale_date)')
+    # Parcial: solo las ventas pendientes de confirmación (pocas filas frente al total)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sales_pending
+        ON sales (seller_id, sale_date) WHERE confirmed = FALSE AND requires_confirmation = TRUE
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_expenses_user_date ON expenses (user_id, expense_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_transfer_requests_requester_status ON transfer_requests (requester_id, status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_discount_requests_seller_status ON discount_requests (seller_id, status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sale_items_sale ON sale_items (sale_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sale_payments_sale ON sale_payments (sale_id)')
+    
+    conn.commit()
+    print("✅ Índices PostgreSQL verificados")
+
+# Resúmenes diarios mantenidos por triggers: el dashboard lee una fila en lugar de agregar el día
+DAILY_SUMMARY_TABLES = (
+    '''CREATE TABLE IF NOT EXISTS sales_daily_summary (
+        seller_id INTEGER NOT NULL,
+        sale_date DATE NOT NULL,
+        total_sales INTEGER NOT NULL DEFAULT 0,
+        confirmed_amount DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        pending_amount DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        pending_confirmations INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (seller_id, sale_date)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS sale_payments_daily_summary (
+        seller_id INTEGER NOT NULL,
+        sale_date DATE NOT NULL,
+        payment_type VARCHAR(50) NOT NULL,
+        total_amount DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (seller_id, sale_date, payment_type)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS expenses_daily_summary (
+        user_id INTEGER NOT NULL,
+        expense_date DATE NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        total DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, expense_date)
+    )''',
+)
+
+DAILY_SUMMARY_FUNCTIONS = (
+    # Suma (sign = 1) o resta (sign = -1) el aporte de una venta a su día
+    '''CREATE OR REPLACE FUNCTION sales_daily_summary_apply(r sales, sign INTEGER) RETURNS void AS $$
+    BEGIN
+        INSERT INTO sales_daily_summary AS ds
+            (seller_id, sale_date, total_sales, confirmed_amount, pending_amount, pending_confirmations)
+        VALUES (
+            r.seller_id, r.sale_date::date, sign,
+            sign * CASE WHEN r.confirmed THEN r.total_amount ELSE 0 END,
+            sign * CASE WHEN NOT r.confirmed AND r.requires_confirmation THEN r.total_amount ELSE 0 END,
+            sign * CASE WHEN NOT r.confirmed AND r.requires_confirmation THEN 1 ELSE 0 END
+        )
+        ON CONFLICT (seller_id, sale_date) DO UPDATE SET
+            total_sales = ds.total_sales + EXCLUDED.total_sales,
+            confirmed_amount = ds.confirmed_amount + EXCLUDED.confirmed_amount,
+            pending_amount = ds.pending_amount + EXCLUDED.pending_amount,
+            pending_confirmations = ds.pending_confirmations + EXCLUDED.pending_confirmations;
+    END
+    $$ LANGUAGE plpgsql''',
+    '''CREATE OR REPLACE FUNCTION sale_payments_daily_summary_apply(
+        p_seller_id INTEGER, p_sale_date DATE, p_payment_type VARCHAR, p_amount DECIMAL, p_count INTEGER
+    ) RETURNS void AS $$
+    BEGIN
+        INSERT INTO sale_payments_daily_summary AS ds (seller_id, sale_date, payment_type, total_amount, count)
+        VALUES (p_seller_id, p_sale_date, p_payment_type, p_amount, p_count)
+        ON CONFLICT (seller_id, sale_date, payment_type) DO UPDATE SET
+            total_amount = ds.total_amount + EXCLUDED.total_amount,
+            count = ds.count + EXCLUDED.count;
+    END
+    $$ LANGUAGE plpgsql''',
+    # Solo cuentan los pagos de ventas confirmadas: al cambiar la venta se mueven todos sus pagos
+    # y al borrar una venta confirmada se descuentan los que aún tenga
+    '''CREATE OR REPLACE FUNCTION sales_daily_summary_trigger() RETURNS trigger AS $$
+    DECLARE
+        p RECORD;
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM sales_daily_summary_apply(OLD, -1);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM sales_daily_summary_apply(NEW, 1);
+        END IF;
+        IF (TG_OP = 'DELETE' AND OLD.confirmed)
+                OR (TG_OP = 'UPDATE' AND (OLD.confirmed, OLD.seller_id, OLD.sale_date::date)
+                    IS DISTINCT FROM (NEW.confirmed, NEW.seller_id, NEW.sale_date::date)) THEN
+            FOR p IN
+                SELECT payment_type, SUM(amount) AS amount, COUNT(*)::int AS cnt
+                FROM sale_payments WHERE sale_id = OLD.id GROUP BY payment_type
+            LOOP
+                IF OLD.confirmed THEN
+                    PERFORM sale_payments_daily_summary_apply(
+                        OLD.seller_id, OLD.sale_date::date, p.payment_type, -p.amount, -p.cnt);
+                END IF;
+                IF TG_OP = 'UPDATE' AND NEW.confirmed THEN
+                    PERFORM sale_payments_daily_summary_apply(
+                        NEW.seller_id, NEW.sale_date::date, p.payment_type, p.amount, p.cnt);
+                END IF;
+            END LOOP;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql''',
+    '''CREATE OR REPLACE FUNCTION sale_payments_daily_summary_trigger() RETURNS trigger AS $$
+    DECLARE
+        s RECORD;
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            SELECT seller_id, sale_date::date AS day, confirmed INTO s FROM sales WHERE id = OLD.sale_id;
+            IF FOUND AND s.confirmed THEN
+                PERFORM sale_payments_daily_summary_apply(s.seller_id, s.day, OLD.payment_type, -OLD.amount, -1);
+            END IF;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            SELECT seller_id, sale_date::date AS day, confirmed INTO s FROM sales WHERE id = NEW.sale_id;
+            IF FOUND AND s.confirmed THEN
+                PERFORM sale_payments_daily_summary_apply(s.seller_id, s.day, NEW.payment_type, NEW.amount, 1);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql''',
+    '''CREATE OR REPLACE FUNCTION expenses_daily_summary_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            INSERT INTO expenses_daily_summary AS ds (user_id, expense_date, count, total)
+            VALUES (OLD.user_id, OLD.expense_date::date, -1, -OLD.amount)
+            ON CONFLICT (user_id, expense_date) DO UPDATE SET
+                count = ds.count + EXCLUDED.count, total = ds.total + EXCLUDED.total;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO expenses_daily_summary AS ds (user_id, expense_date, count, total)
+            VALUES (NEW.user_id, NEW.expense_date::date, 1, NEW.amount)
+            ON CONFLICT (user_id, expense_date) DO UPDATE SET
+                count = ds.count + EXCLUDED.count, total = ds.total + EXCLUDED.total;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql''',
+)
+
+# (tabla, trigger, función)
+DAILY_SUMMARY_TRIGGERS = (
+    ("sales", "trg_sales_daily_summary", "sales_daily_summary_trigger"),
+    ("sale_payments", "trg_sale_payments_daily_summary", "sale_payments_daily_summary_trigger"),
+    ("expenses", "trg_expenses_daily_summary", "expenses_daily_summary_trigger"),
+)
+
+# Carga inicial desde los datos existentes (solo cuando la tabla resumen es nueva)
+DAILY_SUMMARY_BACKFILL = {
+    "sales_daily_summary": '''
+        INSERT INTO sales_daily_summary
+            (seller_id, sale_date, total_sales, confirmed_amount, pending_amount, pending_confirmations)
+        SELECT seller_id, sale_date::date, COUNT(*),
+               COALESCE(SUM(CASE WHEN confirmed THEN total_amount ELSE 0 END), 0),
+               COALESCE(SUM(CASE WHEN NOT confirmed AND requires_confirmation THEN total_amount ELSE 0 END), 0),
+               COUNT(CASE WHEN NOT confirmed AND requires_confirmation THEN 1 END)
+        FROM sales GROUP BY seller_id, sale_date::date
+    ''',
+    "sale_payments_daily_summary": '''
+        INSERT INTO sale_payments_daily_summary (seller_id, sale_date, payment_type, total_amount, count)
+        SELECT s.seller_id, s.sale_date::date, sp.payment_type, SUM(sp.amount), COUNT(*)
+        FROM sale_payments sp
+        JOIN sales s ON sp.sale_id = s.id
+        WHERE s.confirmed
+        GROUP BY s.seller_id, s.sale_date::date, sp.payment_type
+    ''',
+    "expenses_daily_summary": '''
+        INSERT INTO expenses_daily_summary (user_id, expense_date, count, total)
+        SELECT user_id, expense_date::date, COUNT(*), SUM(amount)
+        FROM expenses GROUP BY user_id, expense_date::date
+    ''',
+}
+
+# Mientras falte algún trigger (creación fallida) el dashboard agrega sobre las tablas base
+_daily_summaries_ready = False
+
+def daily_summaries_ready(conn) -> bool:
+    """Los resúmenes son confiables solo si existen sus triggers (una vez listos no se vuelve a consultar)"""
+    global _daily_summaries_ready
+    if not _daily_summaries_ready:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT COUNT(*) FROM pg_trigger WHERE NOT tgisinternal AND tgname = ANY(%s)",
+            ([trigger for _, trigger, _ in DAILY_SUMMARY_TRIGGERS],)
+        )
+        _daily_summaries_ready = cursor.fetchone()[0] == len(DAILY_SUMMARY_TRIGGERS)
+        cursor.close()
+    return _daily_summaries_ready
+
+def create_daily_summaries(conn):
+    """Crear tablas resumen diarias, sus triggers y la carga inicial (todo en una transacción)"""
+    cursor = conn.cursor()
+    try:
+        new_tables = []
+        for table in DAILY_SUMMARY_BACKFILL:
+            cursor.execute("SELECT to_regclass(%s) IS NULL", (table,))
+            if cursor.fetchone()[0]:
+                new_tables.append(table)
+        
+        for statement in DAILY_SUMMARY_TABLES + DAILY_SUMMARY_FUNCTIONS:
+            cursor.execute(statement)
+        
+        # Solo se crean los triggers que faltan: recrearlos en cada arranque bloquearía las tablas.
+        # Crear el trigger bloquea escrituras en la tabla hasta el commit: la carga inicial es consistente
+        for table, trigger, function in DAILY_SUMMARY_TRIGGERS:
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = to_regclass(%s) AND tgname = %s)",
+                (table, trigger)
+            )
+            if cursor.fetchone()[0]:
+                continue
+            cursor.execute(
+                f"CREATE TRIGGER {trigger} AFTER INSERT OR UPDATE OR DELETE ON {table} "
+                f"FOR EACH ROW EXECUTE PROCEDURE {function}()"
+            )
+        
+        for table in new_tables:
+            cursor.execute(DAILY_SUMMARY_BACKFILL[table])
+        
+        conn.commit()
+        print("✅ Resúmenes diarios verificados")
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"⚠️ Error creando resúmenes diarios (el dashboard usará agregados en vivo): {e}")
+    finally:
+        cursor.close()
+
+# Índices del inventario real (products/product_sizes); pg_trgm acelera los ILIKE '%...%'
+INVENTORY_INDEX_STATEMENTS = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_ref_loc ON products (reference_code, location_name)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_product_sizes_prod_size ON product_sizes (product_id, size)",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_search_trgm ON products
+       USING gin (description gin_trgm_ops, brand gin_trgm_ops, model gin_trgm_ops)""",
+)
+
+def create_inventory_indexes(conn):
+    """Crear índices de inventario sin bloquear escrituras (cada sentencia es independiente)"""
+    # CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        for statement in INVENTORY_INDEX_STATEMENTS:
+            try:
+                cursor.execute(statement)
+            except psycopg2.Error as e:
+                # Ej.: tablas aún no creadas o sin permisos para la extensión
+                print(f"⚠️ Índice de inventario omitido: {e}")
+    finally:
+        cursor.close()
+        conn.autocommit = False
+    print("✅ Índices de inventario verificados")
 
 # ==================== EJECUTAR APLICACIÓN ====================
 
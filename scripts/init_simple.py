@@ -1,57 +1,75 @@
 # scripts/init_simple.py
 import sys
 import os
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.core.database_sqlite import get_db, init_database
-from app.services.auth_service import auth_service
+from app.core.database_sqlite import get_db_connection, get_write_db, create_tables
+from app.core.security import get_password_hash
+
+# Usuarios iniciales: (email, password, first_name, last_name, role)
+SEED_USERS = [
+    ("admin@tustockya.com", "admin123", "Admin", "TuStockYa", "administrador"),
+    ("vendedor@test.com", "test123", "Vendedor", "Prueba", "vendedor"),
+]
+
+def _existing_seed_emails() -> set:
+    """Emails de SEED_USERS ya registrados (lectura corta, sin abrir los pools)"""
+    emails = [user[0] for user in SEED_USERS]
+    with closing(get_db_connection(readonly=True)) as conn:
+        table = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone()
+        if table is None:
+            return set()
+        cursor = conn.execute(
+            f"SELECT email FROM users WHERE email IN ({', '.join('?' * len(emails))})", emails
+        )
+        return {row[0] for row in cursor.fetchall()}
 
 def create_initial_data():
-    """Crear datos iniciales"""
+    """Crear tablas y datos iniciales en una sola transacción"""
     
-    # Primero inicializar las tablas
-    init_database()
+    # bcrypt en paralelo y antes de la transacción: el lock de escritura no espera al hashing
+    existing_emails = _existing_seed_emails()
+    new_users = [user for user in SEED_USERS if user[0] not in existing_emails]
+    password_hashes = []
+    if new_users:
+        with ProcessPoolExecutor() as executor:
+            password_hashes = list(executor.map(get_password_hash, [user[1] for user in new_users]))
     
-    # Crear ubicación
-    with get_db() as conn:
+    with get_write_db() as conn:
+        # Primero las tablas
+        create_tables(conn)
+        
+        # Crear ubicación
         cursor = conn.execute("SELECT id FROM locations WHERE name = ?", ("Local Principal",))
-        if not cursor.fetchone():
-            conn.execute(
+        location = cursor.fetchone()
+        if location:
+            location_id = location[0]
+        else:
+            cursor = conn.execute(
                 "INSERT INTO locations (name, type, address) VALUES (?, ?, ?)",
                 ("Local Principal", "local", "Dirección principal")
             )
-            conn.commit()
+            location_id = cursor.lastrowid
             print("✅ Ubicación creada")
         
-        cursor = conn.execute("SELECT id FROM locations WHERE name = ?", ("Local Principal",))
-        location_id = cursor.fetchone()[0]
-    
-    # Crear usuarios
-    try:
-        admin = auth_service.create_user(
-            email="admin@tustockya.com",
-            password="admin123",
-            first_name="Admin",
-            last_name="TuStockYa",
-            role="administrador",
-            location_id=location_id
+        # Crear usuarios nuevos (si otro proceso los creó entretanto, se ignoran)
+        user_rows = [
+            (email, password_hash, first_name, last_name, role, location_id)
+            for (email, _, first_name, last_name, role), password_hash in zip(new_users, password_hashes)
+        ]
+        conn.executemany(
+            '''INSERT OR IGNORE INTO users (email, password_hash, first_name, last_name, role, location_id)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            user_rows
         )
-        print("✅ Usuario admin creado: admin@tustockya.com / admin123")
-    except Exception as e:
-        print(f"⚠️ Usuario admin: {e}")
     
-    try:
-        vendedor = auth_service.create_user(
-            email="vendedor@test.com",
-            password="test123",
-            first_name="Vendedor",
-            last_name="Prueba",
-            role="vendedor",
-            location_id=location_id
-        )
-        print("✅ Usuario vendedor creado: vendedor@test.com / test123")
-    except Exception as e:
-        print(f"⚠️ Usuario vendedor: {e}")
+    for email, password, _, _, role in SEED_USERS:
+        if email in existing_emails:
+            print(f"✅ Usuario {role} ya existe: {email}")
+        else:
+            print(f"✅ Usuario {role}: {email} / {password}")
 
 if __name__ == "__main__":
-    create_initial_data()
\ No newline at end of file
+    create_initial_data()
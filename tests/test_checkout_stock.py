@@ -0,0 +1,58 @@
+# tests/test_checkout_stock.py
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    """main_standalone contra una base SQLite temporal"""
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv("UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.delenv("RENDER", raising=False)
+    sys.modules.pop("main_standalone", None)
+    import main_standalone
+    yield main_standalone
+    sys.modules.pop("main_standalone", None)
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript('''
+        CREATE TABLE locations (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE products (id INTEGER PRIMARY KEY, reference_code TEXT, location_name TEXT);
+        CREATE TABLE product_sizes (id INTEGER PRIMARY KEY, product_id INTEGER, size TEXT, quantity INTEGER);
+        INSERT INTO locations (id, name) VALUES (1, 'Local Principal');
+        INSERT INTO products (id, reference_code, location_name) VALUES (1, 'NK-AF1-001', 'Local Principal');
+        -- Filas duplicadas para la misma referencia y talla
+        INSERT INTO product_sizes (id, product_id, size, quantity) VALUES (10, 1, '9.0', 1), (11, 1, '9.0', 5);
+    ''')
+    yield conn
+    conn.close()
+
+
+def _quantities(conn):
+    return dict(conn.execute('SELECT id, quantity FROM product_sizes ORDER BY id').fetchall())
+
+
+def test_duplicate_rows_decrement_only_lowest_id(main, conn):
+    items = [{'sneaker_reference_code': 'NK-AF1-001', 'size': '9.0', 'quantity': 1}]
+
+    issues = main.checkout_stock(conn, items, 1, validate=True)
+
+    assert issues == []
+    assert _quantities(conn) == {10: 0, 11: 5}
+
+
+def test_duplicate_rows_validate_against_the_chosen_row(main, conn):
+    items = [{'sneaker_reference_code': 'NK-AF1-001', 'size': '9.0', 'quantity': 2}]
+
+    issues = main.checkout_stock(conn, items, 1, validate=True)
+
+    assert issues == [{'reference': 'NK-AF1-001', 'size': '9.0', 'requested': 2, 'available': 1}]
+    assert _quantities(conn) == {10: 1, 11: 5}